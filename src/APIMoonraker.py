@@ -8,28 +8,66 @@
 
 import json
 import time
-import urllib.parse
-import urllib.request
-import operator
+import http.client
+import heapq
 import socket
 
+# optional, allows parsing large file lists while they arrive
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+from HTTPConnectionPool import HTTPConnectionPool
+from CircuitBreaker import CircuitBreaker
+from HostProbe import HostProbe
+from StateCache import StateCache
+from PushMoonraker import PushMoonraker
+
 class APIMoonraker():
     # TODO are these states correct?
     statesWithWarning = [
         "printing", "pausing", "paused"
     ]
 
+    # queried together in one request for all status getters
+    statusObjects = [
+        "extruder", "heater_bed", "print_stats", "virtual_sdcard", "pause_resume"
+    ]
+
+    # print_stats states mapped to OctoPrint job states
+    printStatsStates = {
+        "standby": "Operational",
+        "printing": "Printing",
+        "paused": "Paused",
+        "complete": "Operational",
+        "cancelled": "Operational",
+        "error": "Error"
+    }
+
+    # Klipper heaters with the names used by OctoPrint
+    heaterNames = {
+        "extruder": "tool0",
+        "heater_bed": "bed"
+    }
+
     def __init__(self, parent, host, webcam):
         self.parent = parent
         self.host = host
         self.webcamIndex = int(webcam)
+        self.devices = []
+        self.name = None
+        self.cache = StateCache(parent.stateCacheTimeout)
+        self.breaker = CircuitBreaker.forHost(host)
+        self.probe = HostProbe.forHost(host)
+        self.push = PushMoonraker(self)
 
     # return list of tuples ( "name", func(name) )
     # with all available commands.
     # call function with name of action!
+    # uses capabilities discovered before, no network access.
     def getAvailableCommands(self):
         commands = []
-        self.devices = self.getDeviceList()
 
         for d in self.devices:
             #for a in [ "Turn on", "Turn off", "Toggle" ]:
@@ -45,47 +83,120 @@ class APIMoonraker():
     ############
 
     # only used internally
-    def sendRequest(self, headers, path, content = None):
+    def sendRequest(self, headers, path, content = None, reader = None):
         url = "http://" + self.host + "/" + path
-        if content == None:
-            request = urllib.request.Request(url, None, headers)
-        else:
+        data = None
+        if content != None:
             data = content.encode('ascii')
-            request = urllib.request.Request(url, data, headers)
+
+        # don't wait for timeouts of hosts known to be down
+        if not self.isReachable():
+            return "offline"
+        if not self.breaker.allowRequest():
+            return "offline"
 
         try:
-            with urllib.request.urlopen(request, None, self.parent.networkTimeout) as response:
-                text = response.read()
-                #print("Klipper Rx: \"" + str(text) + "\"\n")
-                return text
-        except (urllib.error.URLError, urllib.error.HTTPError) as error:
-            print("Error requesting URL \"" + url + "\": \"" + str(error) + "\"")
-            return "error"
+            status, text = HTTPConnectionPool.request(url, data, headers, self.parent.networkTimeout, reader)
+            #print("Klipper Rx: \"" + str(text) + "\"\n")
         except socket.timeout:
             print("Timeout waiting for response to \"" + url + "\"")
+            self.breaker.failure()
             return "timeout"
+        except (OSError, http.client.HTTPException) as error:
+            print("Error requesting URL \"" + url + "\": \"" + str(error) + "\"")
+            self.breaker.failure()
+            return "error"
+        except Exception:
+            # anything else, like a broken body in the reader,
+            # still has to finish a half-open probe of the breaker
+            self.breaker.failure()
+            raise
+
+        # host is reachable, even when it reports an error
+        self.breaker.success()
+        self.probe.reachable()
+
+        if status >= 400:
+            print("Error requesting URL \"" + url + "\": \"HTTP status " + str(status) + "\"")
+            return "error"
+        return text
+
+    # last result of background probe, never blocks
+    def isReachable(self):
+        return self.probe.isReachable()
+
+    # quick TCP connect check, may block shortly. runs in worker thread
+    def probeReachable(self):
+        return self.probe.probe()
 
     # only used internally
     def sendPostRequest(self, path, content):
         headers = {
             "Content-Type": "application/json"
         }
+
+        # printer state may change with any command
+        self.cache.invalidate()
+
         return self.sendRequest(headers, path, content)
 
     # only used internally
-    def sendGetRequest(self, path):
+    def sendGetRequest(self, path, reader = None):
         headers = {}
-        return self.sendRequest(headers, path)
+        return self.sendRequest(headers, path, None, reader)
+
+    ###############
+    # Push Update #
+    ###############
+
+    # keep printer objects updated by Moonraker, polling is only used as fallback
+    def startPush(self):
+        self.push.start()
+
+    def stopPush(self):
+        self.push.stop()
 
     #####################
     # Command discovery #
     #####################
 
+    # changes when the server software or its components change.
+    # returns None when printer can not be reached.
+    def getVersion(self):
+        r = self.sendGetRequest("server/info")
+        if (r == "timeout") or (r == "error") or (r == "offline"):
+            return None
+
+        try:
+            rd = json.loads(r)
+            if "result" in rd:
+                v = "Moonraker " + str(rd["result"].get("moonraker_version", "unknown"))
+                if "components" in rd["result"]:
+                    # power devices are only available with their component
+                    v += " " + ",".join(sorted(rd["result"]["components"]))
+                return v
+        except json.JSONDecodeError:
+            pass
+        return None
+
+    # probe everything needed to build the menu.
+    # returns dict that can be stored in CapabilityCache.
+    def getCapabilities(self):
+        return {
+            "devices": self.getDeviceList(),
+            "name": self.getNameInternal()
+        }
+
+    # use probed or cached capabilities
+    def setCapabilities(self, capabilities):
+        self.devices = capabilities.get("devices", [])
+        self.name = capabilities.get("name", None)
+
     def getDeviceList(self):
         devices = []
 
         r = self.sendGetRequest("machine/device_power/devices")
-        if (r == "timeout") or (r == "error"):
+        if (r == "timeout") or (r == "error") or (r == "offline"):
             return devices
 
         try:
@@ -113,7 +224,11 @@ class APIMoonraker():
 
     # only used internally
     def stateSafetyCheck(self, actionString):
-        state = self.getState()
+        return self.stateSafetyDialog(self.getState(), actionString)
+
+    # ask user when state is unsafe, returns True to abort.
+    # for callers that already know the state.
+    def stateSafetyDialog(self, state, actionString):
         if state.lower() in self.statesWithWarning:
             if self.parent.showDialog("OctoTray Warning", "The printer seems to be running currently!", "Do you really want to " + actionString + "?", True, True) == False:
                 return True
@@ -168,64 +283,110 @@ class APIMoonraker():
     # Status Information #
     ######################
 
+    # only used internally
+    def getCachedJSON(self, path):
+        def fetch():
+            r = self.sendGetRequest(path)
+            try:
+                return json.loads(r)
+            except json.JSONDecodeError:
+                return None
+
+        return self.cache.get(path, fetch)
+
+    # only used internally, dict of all status objects or None.
+    # answered locally from push subscription when available,
+    # otherwise all objects are fetched in one batched query.
+    def getPrinterObjects(self):
+        if self.push.isValid():
+            return self.push.status
+
+        rd = self.getCachedJSON("printer/objects/query?" + "&".join(self.statusObjects))
+        if (rd != None) and ("result" in rd):
+            if "status" in rd["result"]:
+                return rd["result"]["status"]
+        return None
+
+    # only used internally, status dict of printer object or None
+    def getObject(self, name):
+        objects = self.getPrinterObjects()
+        if (objects != None) and (name in objects):
+            return objects[name]
+        return None
+
     # only used internally
     def getState(self):
-        # just using octoprint compatibility layer
-        r = self.sendGetRequest("api/job")
-        try:
-            rd = json.loads(r)
-            if "state" in rd:
-                return rd["state"]
-        except json.JSONDecodeError:
-            pass
+        printStats = self.getObject("print_stats")
+        if (printStats != None) and ("state" in printStats):
+            if printStats["state"] in self.printStatsStates:
+                return self.printStatsStates[printStats["state"]]
         return "Unknown"
 
     # only used internally
     def getTemperatureIsSafe(self, limit = 50.0):
-        self.sendGetRequest("printer/objects/query?extruder=temperature")
-        if (r == "timeout") or (r == "error"):
-            return files
+        extruder = self.getObject("extruder")
 
         temp = 0.0
 
-        try:
-            rd = json.loads(r)
-            if "result" in rd:
-                if "status" in rd["result"]:
-                    if "extruder" in rd["result"]["status"]:
-                        if "temperature" in rd["result"]["status"]["extruder"]:
-                            temp = float(rd["result"]["status"]["extruder"]["temperature"])
-
-        except json.JSONDecodeError:
-            pass
+        if (extruder != None) and ("temperature" in extruder):
+            temp = float(extruder["temperature"])
 
         return temp < limit
 
     # human readable temperatures
     def getTemperatureString(self):
-        r = self.sendGetRequest("printer/objects/query?extruder=temperature,target")
+        extruder = self.getObject("extruder")
         s = "Unknown"
 
-        try:
-            rd = json.loads(r)
-            if "result" in rd:
-                if "status" in rd["result"]:
-                    if "extruder" in rd["result"]["status"]:
-                        temp = 0.0
-                        target = 0.0
-                        if "temperature" in rd["result"]["status"]["extruder"]:
-                            temp = float(rd["result"]["status"]["extruder"]["temperature"])
-                        if "target" in rd["result"]["status"]["extruder"]:
-                            target = float(rd["result"]["status"]["extruder"]["target"])
-                        s = str(temp) + " / " + str(target)
-
-        except json.JSONDecodeError:
-            pass
+        if extruder != None:
+            temp = 0.0
+            target = 0.0
+            if "temperature" in extruder:
+                temp = float(extruder["temperature"])
+            if "target" in extruder:
+                target = float(extruder["target"])
+            s = str(temp) + " / " + str(target)
 
         return s
 
+    # normalized status for dashboard and tray, without network
+    # access when push updates are available. temperatures is a
+    # dict of name: ( actual, target ), other values may be None.
+    # reachable is false while requests fail without being sent,
+    # because the host failed its probe or too many requests.
+    def getStatus(self):
+        status = {
+            "name": self.host,
+            "reachable": self.isReachable() and not self.breaker.isOpen(),
+            "state": self.getState(),
+            "completion": None,
+            "printTime": None,
+            "printTimeLeft": None,
+            "temperatures": {}
+        }
+
+        if self.name != None:
+            status["name"] = self.name
+
+        progress = self.getProgress()
+        if isinstance(progress, dict):
+            status.update(progress)
+
+        for obj, name in self.heaterNames.items():
+            heater = self.getObject(obj)
+            if (heater != None) and ("temperature" in heater):
+                status["temperatures"][name] = ( float(heater["temperature"]), heater.get("target", None) )
+
+        return status
+
     # human readable name (fall back to hostname)
     def getName(self):
+        if self.name != None:
+            return self.name
+        return self.getNameInternal()
+
+    # only used internally
+    def getNameInternal(self):
         r = self.sendGetRequest("printer/info")
         s = self.host
 
@@ -241,20 +402,32 @@ class APIMoonraker():
         return s
 
     # only used internally
+    # same structure as progress in OctoPrint job state
     def getProgress(self):
-        # just using octoprint compatibility layer
-        r = self.sendGetRequest("api/job")
-        try:
-            rd = json.loads(r)
-            if "progress" in rd:
-                return rd["progress"]
-        except json.JSONDecodeError:
-            pass
-        return "Unknown"
+        printStats = self.getObject("print_stats")
+        sdcard = self.getObject("virtual_sdcard")
+        if (printStats == None) or (sdcard == None):
+            return "Unknown"
+
+        progress = {
+            "completion": None,
+            "printTime": None,
+            "printTimeLeft": None
+        }
+
+        if ("state" in printStats) and (printStats["state"] in [ "printing", "paused" ]):
+            if ("progress" in sdcard) and ("print_duration" in printStats):
+                done = float(sdcard["progress"])
+                duration = float(printStats["print_duration"])
+                progress["completion"] = done * 100.0
+                progress["printTime"] = duration
+                if done > 0.0:
+                    progress["printTimeLeft"] = (duration / done) - duration
+
+        return progress
 
     # human readable progress
     def getProgressString(self):
-        # just using octoprint compatibility layer
         s = ""
         progress = self.getProgress()
         if ("completion" in progress) and ("printTime" in progress) and ("printTimeLeft" in progress) and (progress["completion"] != None) and (progress["printTime"] != None) and (progress["printTimeLeft"] != None):
@@ -269,45 +442,23 @@ class APIMoonraker():
     # Printer Actions #
     ###################
 
-    # only used internally
-    def sendGCode(self, cmd):
-        self.sendPostRequest("printer/gcode/script?script=" + cmd, "")
+    # only used internally.
+    # takes one command or a list of commands, which are
+    # sent together as one script in a single request.
+    def sendGCode(self, cmds):
+        if isinstance(cmds, str):
+            cmds = [ cmds ]
+        script = "\n".join(cmds)
+        self.sendPostRequest("printer/gcode/script", json.dumps({ "script": script }))
 
     # only used internally
     def isPaused(self):
-        r = self.sendGetRequest("objects/query?pause_resume")
+        pauseResume = self.getObject("pause_resume")
 
         p = False
 
-        try:
-            rd = json.loads(r)
-            if "result" in rd:
-                if "status" in rd["result"]:
-                    if "pause_resume" in rd["result"]["status"]:
-                        if "is_paused" in rd["result"]["status"]["pause_resume"]:
-                            p = rd["result"]["status"]["pause_resume"]["is_paused"]
-
-        except json.JSONDecodeError:
-            pass
-
-        return bool(p)
-
-    # only used internally
-    def isPositioningAbsolute(self):
-        r = self.sendGetRequest("printer/objects/query?gcode_move=absolute_coordinates")
-
-        p = True
-
-        try:
-            rd = json.loads(r)
-            if "result" in rd:
-                if "status" in rd["result"]:
-                    if "gcode_move" in rd["result"]["status"]:
-                        if "absolute_coordinates" in rd["result"]["status"]["gcode_move"]:
-                            p = rd["result"]["status"]["gcode_move"]["absolute_coordinates"]
-
-        except json.JSONDecodeError:
-            pass
+        if (pauseResume != None) and ("is_paused" in pauseResume):
+            p = pauseResume["is_paused"]
 
         return bool(p)
 
@@ -316,57 +467,52 @@ class APIMoonraker():
             return
 
         # always home in XYZ order
-        if "x" in axes:
-            self.sendGCode("G28 X")
-        if "y" in axes:
-            self.sendGCode("G28 Y")
-        if "z" in axes:
-            self.sendGCode("G28 Z")
+        cmds = []
+        for axis in "xyz":
+            if axis in axes:
+                cmds.append("G28 " + axis.upper())
+        self.sendGCode(cmds)
 
     def callMove(self, axis, dist, speed, relative = True):
         if self.stateSafetyCheck("move it"):
             return
 
-        currentlyAbsolute = self.isPositioningAbsolute()
+        self.sendMoves([ (axis, dist) ], speed, relative)
 
-        if currentlyAbsolute and relative:
-            # set to relative positioning
-            self.sendGCode("G91")
+    # relative moves, list of tuples ( axis, distance ).
+    # caller needs to do safety checks.
+    def callMoves(self, moves, speed):
+        self.sendMoves(moves, speed, True)
 
-        if (not currentlyAbsolute) and (not relative):
-            # set to absolute positioning
-            self.sendGCode("G90")
-
-        # do move
-        if axis.lower() == "x":
-            self.sendGCode("G0 X" + str(dist) + " F" + str(speed))
-        elif axis.lower() == "y":
-            self.sendGCode("G0 Y" + str(dist) + " F" + str(speed))
-        elif axis.lower() == "z":
-            self.sendGCode("G0 Z" + str(dist) + " F" + str(speed))
+    # only used internally
+    def sendMoves(self, moves, speed, relative):
+        mode = "G90"
+        if relative:
+            mode = "G91"
 
-        if currentlyAbsolute and relative:
-            # set to absolute positioning
-            self.sendGCode("G90")
+        # positioning mode of printer is restored after moves
+        cmds = [ "SAVE_GCODE_STATE NAME=octotray_move", mode ]
+        for axis, dist in moves:
+            cmds.append("G0 " + axis.upper() + str(dist) + " F" + str(speed))
+        cmds.append("RESTORE_GCODE_STATE NAME=octotray_move")
 
-        if (not currentlyAbsolute) and (not relative):
-            # set to relative positioning
-            self.sendGCode("G91")
+        # all moves in one request
+        self.sendGCode(cmds)
 
     def callPauseResume(self):
         if self.stateSafetyCheck("pause/resume"):
             return
 
         if self.isPaused():
-            self.sendPostRequest("printer/print/pause", "")
-        else:
             self.sendPostRequest("printer/print/resume", "")
+        else:
+            self.sendPostRequest("printer/print/pause", "")
 
     def callJobCancel(self):
         if self.stateSafetyCheck("cancel"):
             return
 
-        self.sendPostRequest("printer/print/cancel")
+        self.sendPostRequest("printer/print/cancel", "")
 
     def statusDialog(self):
         progress = self.getProgress()
@@ -390,28 +536,40 @@ class APIMoonraker():
     # File Handling #
     #################
 
+    # list of ( name, path ) of the newest files, including those in folders
     def getRecentFiles(self, count):
-        files = []
+        if ijson != None:
+            r = self.sendGetRequest("server/files/list?root=gcodes", lambda response: self.selectRecentFiles(self.streamFiles(response), count))
+            if (r == "timeout") or (r == "error") or (r == "offline"):
+                return []
+            return r
 
-        r = self.sendGetRequest("server/files/directory")
-        if (r == "timeout") or (r == "error"):
-            return files
+        r = self.sendGetRequest("server/files/list?root=gcodes")
+        if (r == "timeout") or (r == "error") or (r == "offline"):
+            return []
 
         try:
             rd = json.loads(r)
             if "result" in rd:
-                if "files" in rd["result"]:
-                    for f in rd["result"]["files"]:
-                        if "filename" in f and "modified" in f:
-                            tmp = (f["filename"], f["modified"])
-                            files.append(tmp)
-
+                return self.selectRecentFiles(rd["result"], count)
         except json.JSONDecodeError:
             pass
-
-        files.sort(reverse = True, key = lambda x: x[1])
-        files = files[:count]
-        return [ ( i[0], i[0] ) for i in files ]
+        return []
+
+    # only used internally.
+    # keeps only the newest entries in a heap instead of sorting everything.
+    def selectRecentFiles(self, files, count):
+        files = ( f for f in files if ("path" in f) and ("modified" in f) )
+        fs = heapq.nlargest(count, files, key = lambda f: f["modified"])
+        return [ ( f["path"], f["path"] ) for f in fs ]
+
+    # only used internally, runs in worker thread.
+    # yields all files while the response arrives.
+    def streamFiles(self, response):
+        try:
+            yield from ijson.items(response, "result.item")
+        except ijson.JSONError as error:
+            print("Error parsing file list of " + self.host + ": \"" + str(error) + "\"")
 
     def printFile(self, path):
         self.sendPostRequest("printer/print/start?filename=" + path, "")
@@ -422,8 +580,13 @@ class APIMoonraker():
 
     # only used internally
     def setTemperature(self, cmd, temp):
-        cmd_str = cmd + " " + str(int(temp))
-        self.sendGCode(cmd_str)
+        self.sendGCode(self.temperatureCommand(cmd, temp))
+
+    # only used internally
+    def temperatureCommand(self, cmd, temp):
+        if temp == None:
+            temp = 0
+        return cmd + " S" + str(int(temp))
 
     def printerHeatTool(self, temp):
         self.setTemperature("M104", temp)
@@ -435,34 +598,37 @@ class APIMoonraker():
         if self.stateSafetyCheck("cool it down"):
             return
 
-        self.printerHeatTool(0)
-        self.printerHeatBed(0)
+        # both heaters in one request
+        self.sendGCode([
+            self.temperatureCommand("M104", 0),
+            self.temperatureCommand("M140", 0)
+        ])
 
     ##########
     # Webcam #
     ##########
 
-    def getWebcamURL(self):
+    # only used internally
+    def getWebcamField(self, field):
         url = ""
 
-        r = self.sendGetRequest("server/webcams/list")
-        if (r == "timeout") or (r == "error"):
-            return url
-
-        try:
-            rd = json.loads(r)
-            if "result" in rd:
-                if "webcams" in rd["result"]:
-                    if len(rd["result"]["webcams"]) > self.webcamIndex:
-                        w = rd["result"]["webcams"][self.webcamIndex]
-                        if "snapshot_url" in w:
-                            url =  w["snapshot_url"]
-
-        except json.JSONDecodeError:
-            pass
+        # cached, so snapshot and stream URL only need one request
+        rd = self.getCachedJSON("server/webcams/list")
+        if (rd != None) and ("result" in rd):
+            if "webcams" in rd["result"]:
+                if len(rd["result"]["webcams"]) > self.webcamIndex:
+                    w = rd["result"]["webcams"][self.webcamIndex]
+                    if field in w:
+                        url =  w[field]
 
         # make relative paths absolute
         if url.startswith("/"):
             url = "http://" + self.host + url
 
         return url
+
+    def getWebcamURL(self):
+        return self.getWebcamField("snapshot_url")
+
+    def getWebcamStreamURL(self):
+        return self.getWebcamField("stream_url")
@@ -9,10 +9,22 @@
 import json
 import time
 import urllib.parse
-import urllib.request
-import operator
+import http.client
+import heapq
 import socket
 
+# optional, allows parsing large file lists while they arrive
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+from HTTPConnectionPool import HTTPConnectionPool
+from CircuitBreaker import CircuitBreaker
+from HostProbe import HostProbe
+from StateCache import StateCache
+from PushOctoprint import PushOctoprint
+
 class APIOctoprint():
     statesWithWarning = [
         "printing", "pausing", "paused"
@@ -22,14 +34,19 @@ class APIOctoprint():
         self.parent = parent
         self.host = host
         self.key = key
+        self.method = "unknown"
+        self.systemCommands = []
+        self.name = None
+        self.cache = StateCache(parent.stateCacheTimeout)
+        self.breaker = CircuitBreaker.forHost(host)
+        self.probe = HostProbe.forHost(host)
+        self.push = PushOctoprint(self)
 
     # return list of tuples ( "name", func(name) )
     # with all available commands.
     # call function with name of action!
+    # uses capabilities discovered before, no network access.
     def getAvailableCommands(self):
-        self.method = self.getMethodInternal()
-        print("OctoPrint " + self.host + " has method " + self.method)
-
         commands = []
 
         if self.method == "unknown":
@@ -37,8 +54,7 @@ class APIOctoprint():
             return commands
 
         # always add available system commands
-        systemCommands = self.getSystemCommands()
-        for sc in systemCommands:
+        for sc in self.systemCommands:
             commands.append((sc, self.callSystemCommand))
 
         if self.method == "psucontrol":
@@ -53,24 +69,50 @@ class APIOctoprint():
     ############
 
     # only used internally
-    def sendRequest(self, headers, path, content = None):
+    def sendRequest(self, headers, path, content = None, reader = None):
         url = "http://" + self.host + "/api/" + path
-        if content == None:
-            request = urllib.request.Request(url, None, headers)
-        else:
+        data = None
+        if content != None:
             data = content.encode('ascii')
-            request = urllib.request.Request(url, data, headers)
+
+        # don't wait for timeouts of hosts known to be down
+        if not self.isReachable():
+            return "offline"
+        if not self.breaker.allowRequest():
+            return "offline"
 
         try:
-            with urllib.request.urlopen(request, None, self.parent.networkTimeout) as response:
-                text = response.read()
-                return text
-        except (urllib.error.URLError, urllib.error.HTTPError) as error:
-            print("Error requesting URL \"" + url + "\": \"" + str(error) + "\"")
-            return "error"
+            status, text = HTTPConnectionPool.request(url, data, headers, self.parent.networkTimeout, reader)
         except socket.timeout:
             print("Timeout waiting for response to \"" + url + "\"")
+            self.breaker.failure()
             return "timeout"
+        except (OSError, http.client.HTTPException) as error:
+            print("Error requesting URL \"" + url + "\": \"" + str(error) + "\"")
+            self.breaker.failure()
+            return "error"
+        except Exception:
+            # anything else, like a broken body in the reader,
+            # still has to finish a half-open probe of the breaker
+            self.breaker.failure()
+            raise
+
+        # host is reachable, even when it reports an error
+        self.breaker.success()
+        self.probe.reachable()
+
+        if status >= 400:
+            print("Error requesting URL \"" + url + "\": \"HTTP status " + str(status) + "\"")
+            return "error"
+        return text
+
+    # last result of background probe, never blocks
+    def isReachable(self):
+        return self.probe.isReachable()
+
+    # quick TCP connect check, may block shortly. runs in worker thread
+    def probeReachable(self):
+        return self.probe.probe()
 
     # only used internally
     def sendPostRequest(self, path, content):
@@ -78,23 +120,86 @@ class APIOctoprint():
             "Content-Type": "application/json",
             "X-Api-Key": self.key
         }
+
+        # printer state may change with any command
+        self.cache.invalidate()
+
         return self.sendRequest(headers, path, content)
 
     # only used internally
-    def sendGetRequest(self, path):
+    def sendGetRequest(self, path, reader = None):
         headers = {
             "X-Api-Key": self.key
         }
-        return self.sendRequest(headers, path)
+        return self.sendRequest(headers, path, None, reader)
+
+    ###############
+    # Push Update #
+    ###############
+
+    # keep state updated by OctoPrint, polling is only used as fallback
+    def startPush(self):
+        self.push.start()
+
+    def stopPush(self):
+        self.push.stop()
+
+    # only used internally, returns "user:session" for push auth or None
+    def getSession(self):
+        r = self.sendPostRequest("login", '{ "passive": true }')
+        try:
+            rd = json.loads(r)
+            if ("name" in rd) and ("session" in rd):
+                return rd["name"] + ":" + rd["session"]
+        except json.JSONDecodeError:
+            pass
+        return None
 
     #####################
     # Command discovery #
     #####################
 
+    # changes when the server software has been updated.
+    # returns None when printer can not be reached.
+    def getVersion(self):
+        r = self.sendGetRequest("version")
+        if (r == "timeout") or (r == "error") or (r == "offline"):
+            return None
+
+        try:
+            rd = json.loads(r)
+            if "server" in rd:
+                return "OctoPrint " + str(rd["server"])
+        except json.JSONDecodeError:
+            pass
+        return None
+
+    # probe everything needed to build the menu.
+    # returns dict that can be stored in CapabilityCache.
+    def getCapabilities(self):
+        method = self.getMethodInternal()
+        print("OctoPrint " + self.host + " has method " + method)
+
+        systemCommands = []
+        if method != "unknown":
+            systemCommands = self.getSystemCommands()
+
+        return {
+            "method": method,
+            "systemCommands": systemCommands,
+            "name": self.getNameInternal()
+        }
+
+    # use probed or cached capabilities
+    def setCapabilities(self, capabilities):
+        self.method = capabilities.get("method", "unknown")
+        self.systemCommands = capabilities.get("systemCommands", [])
+        self.name = capabilities.get("name", None)
+
     # only used internally
     def getMethodInternal(self):
         r = self.sendGetRequest("plugin/psucontrol")
-        if (r != "timeout") and (r != "error"):
+        if (r != "timeout") and (r != "error") and (r != "offline"):
             try:
                 rd = json.loads(r)
                 if "isPSUOn" in rd:
@@ -103,7 +208,7 @@ class APIOctoprint():
                 pass
 
         r = self.sendGetRequest("system/commands/custom")
-        if (r == "timeout") or (r == "error"):
+        if (r == "timeout") or (r == "error") or (r == "offline"):
             return "unknown"
 
         try:
@@ -147,7 +252,11 @@ class APIOctoprint():
 
     # only used internally
     def stateSafetyCheck(self, actionString):
-        state = self.getState()
+        return self.stateSafetyDialog(self.getState(), actionString)
+
+    # ask user when state is unsafe, returns True to abort.
+    # for callers that already know the state.
+    def stateSafetyDialog(self, state, actionString):
         if state.lower() in self.statesWithWarning:
             if self.parent.showDialog("OctoTray Warning", "The printer seems to be running currently!", "Do you really want to " + actionString + "?", True, True) == False:
                 return True
@@ -198,8 +307,7 @@ class APIOctoprint():
         if self.method == "psucontrol":
             self.setPower("on")
         elif self.method == "system":
-            cmds = self.getSystemCommands()
-            for cmd in cmds:
+            for cmd in self.systemCommands:
                 if "on" in cmd:
                     self.callSystemCommand(cmd)
                     break
@@ -209,8 +317,7 @@ class APIOctoprint():
         if self.method == "psucontrol":
             self.setPower("off")
         elif self.method == "system":
-            cmds = self.getSystemCommands()
-            for cmd in cmds:
+            for cmd in self.systemCommands:
                 if "off" in cmd:
                     self.callSystemCommand(cmd)
                     break
@@ -220,30 +327,46 @@ class APIOctoprint():
     ######################
 
     # only used internally
-    def getTemperatureIsSafe(self, limit = 50.0):
-        r = self.sendGetRequest("printer")
-        try:
-            rd = json.loads(r)
+    def getCachedJSON(self, path):
+        def fetch():
+            r = self.sendGetRequest(path)
+            try:
+                return json.loads(r)
+            except json.JSONDecodeError:
+                return None
 
-            if "temperature" in rd:
-                if ("tool0" in rd["temperature"]) and ("actual" in rd["temperature"]["tool0"]):
-                    if rd["temperature"]["tool0"]["actual"] > limit:
-                        return False
+        return self.cache.get(path, fetch)
 
-                if ("tool1" in rd["temperature"]) and ("actual" in rd["temperature"]["tool1"]):
-                    if rd["temperature"]["tool1"]["actual"] > limit:
-                        return False
-        except json.JSONDecodeError:
-            pass
+    # only used internally, parsed /api/printer or None
+    def getPrinterState(self):
+        if self.push.isValid():
+            return self.push.printerState
+        return self.getCachedJSON("printer")
+
+    # only used internally, parsed /api/job or None
+    def getJobState(self):
+        if self.push.isValid():
+            return self.push.jobState
+        return self.getCachedJSON("job")
+
+    # only used internally
+    def getTemperatureIsSafe(self, limit = 50.0):
+        rd = self.getPrinterState()
+        if (rd != None) and ("temperature" in rd):
+            if ("tool0" in rd["temperature"]) and ("actual" in rd["temperature"]["tool0"]):
+                if rd["temperature"]["tool0"]["actual"] > limit:
+                    return False
+
+            if ("tool1" in rd["temperature"]) and ("actual" in rd["temperature"]["tool1"]):
+                if rd["temperature"]["tool1"]["actual"] > limit:
+                    return False
         return True
 
     # human readable temperatures
     def getTemperatureString(self):
-        r = self.sendGetRequest("printer")
+        rd = self.getPrinterState()
         s = ""
-        try:
-            rd = json.loads(r)
-        except json.JSONDecodeError:
+        if rd == None:
             return s
 
         if ("state" in rd) and ("text" in rd["state"]):
@@ -279,28 +402,59 @@ class APIOctoprint():
 
     # only used internally
     def getState(self):
-        r = self.sendGetRequest("job")
-        try:
-            rd = json.loads(r)
-            if "state" in rd:
-                return rd["state"]
-        except json.JSONDecodeError:
-            pass
+        rd = self.getJobState()
+        if (rd != None) and ("state" in rd):
+            return rd["state"]
         return "Unknown"
 
     # only used internally
     def getProgress(self):
-        r = self.sendGetRequest("job")
-        try:
-            rd = json.loads(r)
-            if "progress" in rd:
-                return rd["progress"]
-        except json.JSONDecodeError:
-            pass
+        rd = self.getJobState()
+        if (rd != None) and ("progress" in rd):
+            return rd["progress"]
         return "Unknown"
 
+    # normalized status for dashboard and tray, without network
+    # access when push updates are available. temperatures is a
+    # dict of name: ( actual, target ), other values may be None.
+    # reachable is false while requests fail without being sent,
+    # because the host failed its probe or too many requests.
+    def getStatus(self):
+        status = {
+            "name": self.host,
+            "reachable": self.isReachable() and not self.breaker.isOpen(),
+            "state": self.getState(),
+            "completion": None,
+            "printTime": None,
+            "printTimeLeft": None,
+            "temperatures": {}
+        }
+
+        if self.name != None:
+            status["name"] = self.name
+
+        progress = self.getProgress()
+        if isinstance(progress, dict):
+            for key in [ "completion", "printTime", "printTimeLeft" ]:
+                if key in progress:
+                    status[key] = progress[key]
+
+        rd = self.getPrinterState()
+        if (rd != None) and ("temperature" in rd):
+            for name, t in rd["temperature"].items():
+                if isinstance(t, dict) and ("actual" in t) and (t["actual"] != None):
+                    status["temperatures"][name] = ( t["actual"], t.get("target", None) )
+
+        return status
+
     # human readable name (fall back to hostname)
     def getName(self):
+        if self.name != None:
+            return self.name
+        return self.getNameInternal()
+
+    # only used internally
+    def getNameInternal(self):
         r = self.sendGetRequest("printerprofiles")
         try:
             rd = json.loads(r)
@@ -350,6 +504,12 @@ class APIOctoprint():
 
         self.sendPostRequest("printer/printhead", '{ "command": "jog", "' + str(axis) + '": ' + str(dist) + ', "speed": ' + str(speed) + absolute + ' }')
 
+    # relative moves, list of tuples ( axis, distance ).
+    # caller needs to do safety checks.
+    def callMoves(self, moves, speed):
+        for axis, dist in moves:
+            self.sendPostRequest("printer/printhead", '{ "command": "jog", "' + str(axis) + '": ' + str(dist) + ', "speed": ' + str(speed) + ' }')
+
     def callPauseResume(self):
         if self.stateSafetyCheck("pause/resume"):
             return
@@ -382,19 +542,66 @@ class APIOctoprint():
     # File Handling #
     #################
 
+    # list of ( name, path ) of the newest files, including those in folders
     def getRecentFiles(self, count):
+        if ijson != None:
+            r = self.sendGetRequest("files?recursive=true", lambda response: self.selectRecentFiles(self.streamFiles(response), count))
+            if (r == "timeout") or (r == "error") or (r == "offline"):
+                return []
+            return r
+
         r = self.sendGetRequest("files?recursive=true")
-        files = []
+        if (r == "timeout") or (r == "error") or (r == "offline"):
+            return []
+
         try:
             rd = json.loads(r)
             if "files" in rd:
-                t = [f for f in rd["files"] if "date" in f]
-                fs = sorted(t, key=operator.itemgetter("date"), reverse=True)
-                for f in fs[:count]:
-                    files.append((f["name"], f["origin"] + "/" + f["path"]))
+                return self.selectRecentFiles(self.walkFiles(rd["files"]), count)
         except json.JSONDecodeError:
             pass
-        return files
+        return []
+
+    # only used internally.
+    # keeps only the newest entries in a heap instead of sorting everything.
+    def selectRecentFiles(self, files, count):
+        fs = heapq.nlargest(count, files, key = lambda f: f["date"])
+        return [ ( f["name"], f["origin"] + "/" + f["path"] ) for f in fs ]
+
+    # only used internally, yields all files of parsed tree
+    def walkFiles(self, files):
+        for f in files:
+            if "children" in f:
+                yield from self.walkFiles(f["children"])
+            elif self.isRecentFile(f):
+                yield f
+
+    # only used internally, runs in worker thread.
+    # yields all files while the response arrives, without
+    # building the tree with its analysis data in memory.
+    def streamFiles(self, response):
+        stack = [] # tuples ( prefix, fields of file )
+        try:
+            for prefix, event, value in ijson.parse(response):
+                isEntry = (prefix == "files.item") or prefix.endswith(".children.item")
+                if (event == "start_map") and isEntry:
+                    stack.append((prefix, {}))
+                elif (event == "end_map") and isEntry:
+                    p, f = stack.pop()
+                    if self.isRecentFile(f):
+                        yield f
+                elif (len(stack) > 0) and (event in [ "string", "number" ]):
+                    parent, sep, key = prefix.rpartition(".")
+                    if (parent == stack[-1][0]) and (key in [ "name", "origin", "path", "date", "type" ]):
+                        stack[-1][1][key] = value
+        except ijson.JSONError as error:
+            print("Error parsing file list of " + self.host + ": \"" + str(error) + "\"")
+
+    # only used internally
+    def isRecentFile(self, f):
+        if f.get("type", "") == "folder":
+            return False
+        return ("date" in f) and (f["date"] != None) and ("name" in f) and ("origin" in f) and ("path" in f)
 
     def printFile(self, path):
         self.sendPostRequest("files/" + path, '{ "command": "select", "print": true }')
@@ -436,3 +643,6 @@ class APIOctoprint():
 
     def getWebcamURL(self):
         return "http://" + self.host + ":8080/?action=snapshot"
+
+    def getWebcamStreamURL(self):
+        return "http://" + self.host + ":8080/?action=stream"
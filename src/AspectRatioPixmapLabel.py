@@ -23,6 +23,11 @@ class AspectRatioPixmapLabel(QLabel):
         self.pix = p
         super(AspectRatioPixmapLabel, self).setPixmap(self.scaledPixmap())
 
+    # pixmap already scaled to fit, eg. in a worker thread
+    def setScaledPixmap(self, p):
+        self.pix = p
+        super(AspectRatioPixmapLabel, self).setPixmap(p)
+
     def heightForWidth(self, width):
         if self.pix.isNull():
             return self.height()
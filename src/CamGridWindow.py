@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+# OctoTray Linux Qt System Tray OctoPrint client
+#
+# CamGridWindow.py
+#
+# Shows the webcams of all configured printers as tiles in one window.
+# All tiles share one fetch scheduler and the decoder thread pool.
+
+import math
+import time
+import random
+from PyQt5 import QtNetwork
+from PyQt5.QtWidgets import QWidget, QFrame, QLabel, QVBoxLayout, QGridLayout
+from PyQt5.QtGui import QPixmap
+from PyQt5.QtCore import QUrl, QTimer, Qt, pyqtSignal
+from AspectRatioPixmapLabel import AspectRatioPixmapLabel
+from FrameDecoder import FrameDecoder
+
+class CamTile(QFrame):
+    clicked = pyqtSignal(object)
+    doubleClicked = pyqtSignal(object)
+    loaded = pyqtSignal(object)
+
+    def __init__(self, parent, printer, *args, **kwargs):
+        super(CamTile, self).__init__(*args, **kwargs)
+        self.printer = printer
+        self.url = None
+        self.reply = None
+        self.nextLoad = 0.0
+        self.requestTime = 0.0
+        self.roundTripTime = 0.0 # in s
+        self.errors = 0 # in a row
+        self.infoErrors = 0 # in a row
+
+        self.setFrameShape(QFrame.Box)
+        self.setFocused(False)
+
+        box = QVBoxLayout()
+        self.setLayout(box)
+
+        self.label = QLabel(printer.host)
+        box.addWidget(self.label, 0)
+        box.setAlignment(self.label, Qt.AlignHCenter)
+
+        self.img = AspectRatioPixmapLabel()
+        self.img.setPixmap(QPixmap(320, 240))
+        box.addWidget(self.img, 1)
+
+        self.decoder = FrameDecoder(parent.decodeTasks, self)
+        self.decoder.imageDecoded.connect(self.showImage)
+
+    def setFocused(self, focused):
+        self.focused = focused
+        if focused:
+            self.setLineWidth(3)
+        else:
+            self.setLineWidth(1)
+
+    def replyFinished(self):
+        reply = self.reply
+        self.reply = None
+        reply.deleteLater()
+
+        if reply.error() != QtNetwork.QNetworkReply.NoError:
+            print("Error loading image: " + reply.errorString())
+            self.errors += 1
+        else:
+            self.errors = 0
+            rtt = time.monotonic() - self.requestTime
+            self.roundTripTime += (rtt - self.roundTripTime) * CamGridWindow.roundTripSmoothing
+
+            # decoded directly at tile size
+            self.decoder.decode(bytes(reply.readAll()), self.img.size())
+
+        self.loaded.emit(self)
+
+    def showImage(self, image):
+        self.img.setScaledPixmap(QPixmap.fromImage(image))
+
+    def mousePressEvent(self, event):
+        self.clicked.emit(self)
+
+    def mouseDoubleClickEvent(self, event):
+        self.doubleClicked.emit(self.printer)
+
+class CamGridWindow(QWidget):
+    schedulerInterval = 100 # in ms
+    maxParallelLoads = 4
+
+    focusedReloadDelay = 500 # in ms
+    reloadDelay = 2000 # in ms
+    referenceTileArea = 640 * 360 # smaller tiles refresh slower
+    maxSizeFactor = 4
+    roundTripFactor = 2 # never request faster than this many round trips
+    roundTripSmoothing = 0.3 # weight of newest round trip measurement
+    maxErrorDelay = 60.0 # in s, retries of unreachable webcams
+    infoRetryDelay = 2.0 # in s, first retry of webcam URL lookup
+    imageTimeout = 10 * 1000 # in ms, without progress until snapshot request is aborted
+
+    def __init__(self, parent, *args, **kwargs):
+        super(CamGridWindow, self).__init__(*args, **kwargs)
+        self.parent = parent
+        self.manager = parent.manager
+
+        self.setWindowTitle(parent.name + " Webcam Grid")
+        self.setWindowIcon(parent.icon)
+
+        grid = QGridLayout()
+        self.setLayout(grid)
+
+        self.tiles = []
+        printers = [ p for p in parent.printers if p.api != None ]
+        columns = max(1, math.ceil(math.sqrt(len(printers))))
+        for i in range(0, len(printers)):
+            tile = CamTile(parent, printers[i])
+            tile.clicked.connect(self.focusTile)
+            tile.doubleClicked.connect(parent.printerWebcamAction)
+            tile.loaded.connect(self.tileLoaded)
+            grid.addWidget(tile, int(i / columns), i % columns)
+            self.tiles.append(tile)
+
+            # webcam URL and name may need network requests
+            parent.tasks.run(self.fetchTileInfo, self.setTileInfo, tile, error = lambda e, t=tile: self.tileInfoFailed(t))
+
+        self.scheduler = QTimer(self)
+        self.scheduler.setInterval(self.schedulerInterval)
+        self.scheduler.timeout.connect(self.schedule)
+        self.scheduler.start()
+
+    # runs in worker thread
+    def fetchTileInfo(self, tile):
+        return (tile, tile.printer.api.getWebcamURL(), tile.printer.api.getName())
+
+    # runs in GUI thread
+    def setTileInfo(self, result):
+        tile, url, name = result
+        tile.label.setText(name)
+        if len(url) > 0:
+            tile.url = url
+            tile.infoErrors = 0
+            return
+
+        # printer may be offline, ask again with exponential backoff and jitter
+        delay = min(self.infoRetryDelay * (2 ** min(tile.infoErrors, 16)), self.maxErrorDelay)
+        delay *= random.uniform(0.5, 1.0)
+        tile.infoErrors += 1
+        QTimer.singleShot(int(delay * 1000), lambda t=tile: self.retryTileInfo(t))
+
+    # runs in GUI thread, same as not getting an URL
+    def tileInfoFailed(self, tile):
+        self.setTileInfo((tile, "", tile.label.text()))
+
+    # only used internally
+    def retryTileInfo(self, tile):
+        # window may have been closed in the meantime
+        if self.scheduler.isActive():
+            self.parent.tasks.run(self.fetchTileInfo, self.setTileInfo, tile, error = lambda e, t=tile: self.tileInfoFailed(t))
+
+    def focusTile(self, focused):
+        for tile in self.tiles:
+            tile.setFocused(tile == focused)
+
+        # show change in refresh rate immediately
+        focused.nextLoad = 0.0
+
+    # in s
+    def tileDelay(self, tile):
+        if tile.focused:
+            delay = self.focusedReloadDelay
+        else:
+            area = max(1, tile.img.width() * tile.img.height())
+            factor = min(max(self.referenceTileArea / area, 1.0), self.maxSizeFactor)
+            delay = self.reloadDelay * factor
+
+        # don't flood slow connections
+        delay = max(delay / 1000.0, tile.roundTripTime * self.roundTripFactor)
+
+        # exponential backoff with jitter while webcam is unreachable
+        if tile.errors > 0:
+            delay = min(delay * (2 ** min(tile.errors, 16)), self.maxErrorDelay)
+            delay *= random.uniform(0.5, 1.0)
+
+        return delay
+
+    def schedule(self):
+        if (not self.isVisible()) or self.isMinimized():
+            return
+
+        running = len([ t for t in self.tiles if t.reply != None ])
+        now = time.monotonic()
+
+        # most overdue tiles first
+        for tile in sorted(self.tiles, key = lambda t: t.nextLoad):
+            if running >= self.maxParallelLoads:
+                break
+
+            if (tile.url == None) or (tile.reply != None) or (tile.nextLoad > now):
+                continue
+
+            if tile.visibleRegion().isEmpty():
+                continue
+
+            self.loadTile(tile)
+            running += 1
+
+    def loadTile(self, tile):
+        tile.requestTime = time.monotonic()
+        request = QtNetwork.QNetworkRequest(QUrl(tile.url))
+        request.setTransferTimeout(self.imageTimeout) # aborted request counts as error
+        tile.reply = self.manager.get(request)
+        tile.reply.finished.connect(tile.replyFinished)
+
+    def tileLoaded(self, tile):
+        tile.nextLoad = time.monotonic() + self.tileDelay(tile)
+
+    def closeEvent(self, event):
+        self.scheduler.stop()
+        for tile in self.tiles:
+            if tile.reply != None:
+                tile.reply.abort()
+        self.parent.removeCamGridWindow()
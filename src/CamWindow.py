@@ -9,11 +9,14 @@
 # https://stackoverflow.com/a/22618496
 
 import time
+import random
 from PyQt5 import QtNetwork
-from PyQt5.QtWidgets import QWidget, QLabel, QVBoxLayout, QHBoxLayout, QSlider, QPushButton
-from PyQt5.QtGui import QPixmap, QImageReader
+from PyQt5.QtWidgets import QWidget, QLabel, QVBoxLayout, QHBoxLayout, QSlider, QPushButton, QCheckBox
+from PyQt5.QtGui import QPixmap
 from PyQt5.QtCore import QUrl, QTimer, Qt
 from AspectRatioPixmapLabel import AspectRatioPixmapLabel
+from MJPEGStream import MJPEGStream
+from FrameDecoder import FrameDecoder
 
 class CamWindow(QWidget):
     reloadDelayDefault = 1000 # in ms
@@ -21,17 +24,61 @@ class CamWindow(QWidget):
     reloadOn = True
     sliderFactor = 100
 
+    # adaptive refresh, slider sets the fastest rate
+    idleDelayFactor = 5 # slower while printer is not printing
+    roundTripFactor = 2 # never request faster than this many round trips
+    roundTripSmoothing = 0.3 # weight of newest round trip measurement
+    hiddenCheckDelay = 1000 # in ms, check for visibility while hidden
+    maxErrorDelay = 60 * 1000 # in ms, retries of unreachable webcam
+    streamRetryDelay = 5 * 1000 # in ms, before trying stream again after error
+    imageTimeout = 10 * 1000 # in ms, without progress until snapshot request is aborted
+
     def __init__(self, parent, printer, *args, **kwargs):
         super(CamWindow, self).__init__(*args, **kwargs)
         self.app = parent.app
         self.manager = parent.manager
-        self.manager.finished.connect(self.handleResponse)
         self.parent = parent
         self.printer = printer
 
+        self.printing = True # refresh fast until status is known
+        self.roundTripTime = 0.0 # in s
+        self.requestTime = 0.0
+        self.etag = None
+        self.imageErrors = 0 # in a row
+        self.reply = None # snapshot request in flight
+
+        # one timer, so there is never more than one polling loop
+        self.imageTimer = QTimer(self)
+        self.imageTimer.setSingleShot(True)
+        self.imageTimer.timeout.connect(self.loadImage)
+
         self.url = self.printer.api.getWebcamURL()
         print("Webcam: " + self.url)
 
+        self.decoder = FrameDecoder(parent.decodeTasks, self)
+        self.decoder.imageDecoded.connect(self.showImage)
+
+        self.stream = None
+        self.streamUrl = self.printer.api.getWebcamStreamURL()
+        if len(self.streamUrl) > 0:
+            print("Webcam Stream: " + self.streamUrl)
+            self.stream = MJPEGStream(self.manager, self.streamUrl, self)
+            self.stream.frameReceived.connect(self.handleFrame)
+            self.stream.streamError.connect(self.handleStreamError)
+            self.streamErrors = 0 # in a row
+            self.streamStartTime = 0.0
+
+            # snapshots are only a fallback while stream is broken
+            self.streamRetryTimer = QTimer(self)
+            self.streamRetryTimer.setSingleShot(True)
+            self.streamRetryTimer.timeout.connect(self.retryStream)
+
+            # stream is paused while window can not be seen
+            self.streamTimer = QTimer(self)
+            self.streamTimer.setInterval(self.hiddenCheckDelay)
+            self.streamTimer.timeout.connect(self.checkStream)
+            self.streamTimer.start()
+
         self.setWindowTitle(parent.name + " Webcam Stream")
         self.setWindowIcon(parent.icon)
 
@@ -46,6 +93,7 @@ class CamWindow(QWidget):
         box.addLayout(slide, 0)
 
         self.slideStaticLabel = QLabel("Refresh")
+        self.slideStaticLabel.setToolTip("Fastest refresh, slower while idle or on slow connections")
         slide.addWidget(self.slideStaticLabel, 0)
 
         self.slider = QSlider(Qt.Horizontal)
@@ -62,6 +110,12 @@ class CamWindow(QWidget):
         self.slideLabel = QLabel(str(self.reloadDelayDefault) + "ms")
         slide.addWidget(self.slideLabel, 0)
 
+        self.streamCheckBox = QCheckBox("&Stream")
+        self.streamCheckBox.setEnabled(self.stream != None)
+        self.streamCheckBox.setChecked(self.stream != None)
+        self.streamCheckBox.toggled.connect(self.streamToggled)
+        slide.addWidget(self.streamCheckBox, 0)
+
         self.img = AspectRatioPixmapLabel()
         self.img.setPixmap(QPixmap(640, 480))
         box.addWidget(self.img, 1)
@@ -144,6 +198,11 @@ class CamWindow(QWidget):
         self.ZMButton.clicked.connect(self.moveZM)
         controls_move.addWidget(self.ZMButton)
 
+        self.jogLabel = QLabel(self.printer.jogQueue.getStatus())
+        box.addWidget(self.jogLabel, 0)
+        box.setAlignment(self.jogLabel, Qt.AlignHCenter)
+        self.printer.jogQueue.statusChanged.connect(self.jogLabel.setText)
+
         controls_job = QHBoxLayout()
         box.addLayout(controls_job, 0)
 
@@ -155,7 +214,10 @@ class CamWindow(QWidget):
         self.CancelButton.clicked.connect(self.cancelJob)
         controls_job.addWidget(self.CancelButton)
 
-        self.loadImage()
+        if self.streamCheckBox.isChecked():
+            self.stream.start()
+        else:
+            self.loadImage()
         self.loadStatus()
 
     def pauseResume(self):
@@ -165,22 +227,22 @@ class CamWindow(QWidget):
         self.printer.api.callJobCancel()
 
     def moveXP(self):
-        self.printer.api.callMove("x", int(self.printer.jogLength), int(self.printer.jogSpeed), True)
+        self.printer.jogQueue.addMove("x", int(self.printer.jogLength))
 
     def moveXM(self):
-        self.printer.api.callMove("x", -1 * int(self.printer.jogLength), int(self.printer.jogSpeed), True)
+        self.printer.jogQueue.addMove("x", -1 * int(self.printer.jogLength))
 
     def moveYP(self):
-        self.printer.api.callMove("y", int(self.printer.jogLength), int(self.printer.jogSpeed), True)
+        self.printer.jogQueue.addMove("y", int(self.printer.jogLength))
 
     def moveYM(self):
-        self.printer.api.callMove("y", -1 * int(self.printer.jogLength), int(self.printer.jogSpeed), True)
+        self.printer.jogQueue.addMove("y", -1 * int(self.printer.jogLength))
 
     def moveZP(self):
-        self.printer.api.callMove("z", int(self.printer.jogLength), int(self.printer.jogSpeed), True)
+        self.printer.jogQueue.addMove("z", int(self.printer.jogLength))
 
     def moveZM(self):
-        self.printer.api.callMove("z", -1 * int(self.printer.jogLength), int(self.printer.jogSpeed), True)
+        self.printer.jogQueue.addMove("z", -1 * int(self.printer.jogLength))
 
     def homeX(self):
         self.printer.api.callHoming("x")
@@ -215,25 +277,102 @@ class CamWindow(QWidget):
     def sliderChanged(self):
         self.slideLabel.setText(str(self.slider.value() * self.sliderFactor) + "ms")
 
+    def streamToggled(self, checked):
+        # user or retry has decided, no retry pending anymore
+        self.streamRetryTimer.stop()
+        if checked:
+            self.streamStartTime = time.monotonic()
+            self.stream.start()
+        else:
+            self.stream.stop()
+            self.loadImage()
+
     def closeEvent(self, event):
         self.reloadOn = False
         self.url = ""
+        self.imageTimer.stop()
+        if self.stream != None:
+            self.streamTimer.stop()
+            self.streamRetryTimer.stop()
+            self.stream.stop()
+        self.printer.jogQueue.statusChanged.disconnect(self.jogLabel.setText)
         self.parent.removeWebcamWindow(self)
 
+    # minimized, hidden or completely covered by other windows
+    def isHiddenFromUser(self):
+        return (not self.isVisible()) or self.isMinimized() or self.visibleRegion().isEmpty()
+
+    # in ms
+    def reloadDelay(self):
+        delay = self.slider.value() * self.sliderFactor
+        if not self.printing:
+            delay *= self.idleDelayFactor
+
+        # don't flood slow connections
+        delay = max(delay, self.roundTripTime * 1000 * self.roundTripFactor)
+
+        # exponential backoff with jitter while webcam is unreachable
+        if self.imageErrors > 0:
+            delay = min(delay * (2 ** min(self.imageErrors, 16)), self.maxErrorDelay)
+            delay *= random.uniform(0.5, 1.0)
+
+        return int(delay)
+
     def scheduleLoadImage(self):
-        if self.reloadOn:
-            QTimer.singleShot(self.slider.value() * self.sliderFactor, self.loadImage)
+        if self.reloadOn and not self.streamCheckBox.isChecked():
+            self.imageTimer.start(self.reloadDelay())
 
     def scheduleLoadStatus(self):
         if self.reloadOn:
             QTimer.singleShot(self.slider.value() * self.sliderFactor * self.statusDelayFactor, self.loadStatus)
 
+    def checkStream(self):
+        if not self.streamCheckBox.isChecked():
+            return
+
+        hidden = self.isHiddenFromUser()
+        if hidden and self.stream.isRunning():
+            self.stream.stop()
+        elif (not hidden) and (not self.stream.isRunning()):
+            self.stream.start()
+
     def loadImage(self):
+        # reply of request in flight schedules the next one
+        if (self.reply != None) or self.streamCheckBox.isChecked() or (not self.reloadOn):
+            return
+
+        self.imageTimer.stop()
+
+        if self.isHiddenFromUser():
+            # nothing to see, check again later without loading
+            self.imageTimer.start(self.hiddenCheckDelay)
+            return
+
+        self.requestTime = time.monotonic()
         url = QUrl(self.url)
         request = QtNetwork.QNetworkRequest(url)
-        self.manager.get(request)
+
+        # kept-alive connection to a rebooted webcam would hang for minutes
+        request.setTransferTimeout(self.imageTimeout)
+
+        # server can tell us when snapshot has not changed
+        if self.etag != None:
+            request.setRawHeader(b"If-None-Match", self.etag)
+
+        # only this window handles the reply, not all users of the manager
+        reply = self.manager.get(request)
+        reply.finished.connect(lambda r=reply: self.handleResponse(r))
+        self.reply = reply
 
     def loadStatus(self):
+        if self.isHiddenFromUser():
+            self.scheduleLoadStatus()
+            return
+
+        self.parent.tasks.run(self.fetchStatus, self.showStatus, error = lambda e: self.scheduleLoadStatus())
+
+    # runs in worker thread
+    def fetchStatus(self):
         s = "Status: "
         t = self.printer.api.getTemperatureString()
         if len(t) > 0:
@@ -249,26 +388,78 @@ class CamWindow(QWidget):
         else:
             s += "Unknown"
 
+        state = self.printer.api.getState()
+        return (s, state)
+
+    # runs in GUI thread
+    def showStatus(self, result):
+        if not self.reloadOn:
+            return
+
+        s, state = result
+        self.printing = state.lower() in self.printer.api.statesWithWarning
         self.statusLabel.setText(s)
         self.scheduleLoadStatus()
 
     def handleResponse(self, reply):
-        if reply.url().url() != self.url:
-            print("Reponse for unknown resource: " + reply.url().url())
-            return
+        if reply == self.reply:
+            self.reply = None
+        reply.deleteLater()
 
         if reply.error() != QtNetwork.QNetworkReply.NoError:
             print("Error loading image: " + reply.errorString())
+
+            # keep trying, so the image comes back with the webcam
+            self.imageErrors += 1
+            self.scheduleLoadImage()
             return
 
-        reader = QImageReader(reply)
-        reader.setAutoTransform(True)
-        image = reader.read()
-        if image == None:
-            print("Error decoding image: " + reader.errorString())
+        self.imageErrors = 0
+        rtt = time.monotonic() - self.requestTime
+        self.roundTripTime += (rtt - self.roundTripTime) * self.roundTripSmoothing
+
+        # unchanged snapshot, nothing to decode or repaint
+        if reply.attribute(QtNetwork.QNetworkRequest.HttpStatusCodeAttribute) == 304:
+            self.scheduleLoadImage()
             return
 
-        if image.colorSpace().isValid():
-            image.convertToColorSpace(QColorSpace.SRgb)
-        self.img.setPixmap(QPixmap.fromImage(image))
+        self.etag = None
+        if reply.hasRawHeader(b"ETag"):
+            self.etag = bytes(reply.rawHeader(b"ETag"))
+
+        self.handleFrame(bytes(reply.readAll()))
         self.scheduleLoadImage()
+
+    def handleFrame(self, data):
+        # decoded and scaled to label size off the GUI thread,
+        # at full resolution only when there is room to show it
+        fullResolution = self.isMaximized() or self.isFullScreen()
+        self.decoder.decode(data, self.img.size(), fullResolution)
+
+    def handleStreamError(self, error):
+        # fall back to polling snapshots for a while
+        print("Error in webcam stream: " + error)
+        self.streamCheckBox.setChecked(False)
+
+        # stream that worked for a while starts over without backoff
+        if (time.monotonic() - self.streamStartTime) > (self.maxErrorDelay / 1000):
+            self.streamErrors = 0
+
+        # exponential backoff with jitter, like for snapshots
+        delay = min(self.streamRetryDelay * (2 ** min(self.streamErrors, 16)), self.maxErrorDelay)
+        delay *= random.uniform(0.5, 1.0)
+        self.streamErrors += 1
+        if self.reloadOn:
+            self.streamRetryTimer.start(int(delay))
+
+    def retryStream(self):
+        if self.isHiddenFromUser():
+            # stream would be paused anyway, check again later
+            self.streamRetryTimer.start(self.hiddenCheckDelay)
+            return
+
+        print("Trying webcam stream again")
+        self.streamCheckBox.setChecked(True)
+
+    def showImage(self, image):
+        self.img.setScaledPixmap(QPixmap.fromImage(image))
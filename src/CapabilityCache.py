@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+# OctoTray Linux Qt System Tray OctoPrint client
+#
+# CapabilityCache.py
+#
+# Stores the discovered capabilities of each printer on disk,
+# so menus can be built at startup without waiting for the network.
+# Only used from the GUI thread.
+
+import os
+import json
+import time
+import hashlib
+from PyQt5.QtCore import QStandardPaths
+
+class CapabilityCache():
+    fileName = "capabilities.json"
+    maxAge = 24 * 60 * 60 # in s, probe again even without version change
+
+    def __init__(self):
+        self.path = os.path.join(QStandardPaths.writableLocation(QStandardPaths.CacheLocation), self.fileName)
+        self.entries = {}
+
+        try:
+            with open(self.path, "r") as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as error:
+            print("Error reading capability cache \"" + self.path + "\": \"" + str(error) + "\"")
+
+        if not isinstance(self.entries, dict):
+            self.entries = {}
+
+    # only used internally.
+    # capabilities depend on the API key, which is only stored hashed.
+    def key(self, printer):
+        secret = hashlib.sha256((str(printer.key) + " " + str(printer.webcam)).encode("utf-8")).hexdigest()
+        return printer.apiType.lower() + " " + printer.host + " " + secret[:16]
+
+    # returns dict stored for printer or None
+    def get(self, printer):
+        entry = self.entries.get(self.key(printer))
+        if not isinstance(entry, dict) or ("capabilities" not in entry):
+            return None
+        return entry["capabilities"]
+
+    # true when capabilities should be probed again, even for same version
+    def isExpired(self, printer):
+        entry = self.entries.get(self.key(printer))
+        if not isinstance(entry, dict) or ("time" not in entry):
+            return True
+        return (time.time() - entry["time"]) > self.maxAge
+
+    def set(self, printer, capabilities):
+        self.entries[self.key(printer)] = {
+            "time": time.time(),
+            "capabilities": capabilities
+        }
+        self.save()
+
+    # only used internally
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok = True)
+
+            # replace atomically, so a crash never leaves a broken file
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.entries, f, indent = 4)
+            os.replace(tmp, self.path)
+        except OSError as error:
+            print("Error writing capability cache \"" + self.path + "\": \"" + str(error) + "\"")
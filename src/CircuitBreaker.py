@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+# OctoTray Linux Qt System Tray OctoPrint client
+#
+# CircuitBreaker.py
+#
+# Remembers which hosts are not answering, so requests to
+# them can fail immediately instead of waiting for a timeout.
+# After repeated failures the breaker opens. Then only single
+# probe requests are let through, with exponential backoff.
+
+import random
+import threading
+import time
+
+class CircuitBreaker():
+    failureThreshold = 3 # failures in a row until breaker opens
+    retryDelay = 2.0 # in s, before first probe
+    maxRetryDelay = 60.0 # in s
+
+    # one breaker for each host
+    breakers = {}
+    breakersLock = threading.Lock()
+
+    def __init__(self, host):
+        self.host = host
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.probing = False
+        self.retryTime = 0.0
+
+    # shared breaker for this host, created on first use
+    @classmethod
+    def forHost(cls, host):
+        with cls.breakersLock:
+            if host not in cls.breakers:
+                cls.breakers[host] = CircuitBreaker(host)
+            return cls.breakers[host]
+
+    # true when host seems to be unreachable
+    def isOpen(self):
+        with self.lock:
+            return self.failures >= self.failureThreshold
+
+    # false when request should not be sent
+    def allowRequest(self):
+        with self.lock:
+            if self.failures < self.failureThreshold:
+                return True
+
+            # half-open, only one probe at a time
+            if self.probing or (time.monotonic() < self.retryTime):
+                return False
+
+            self.probing = True
+            return True
+
+    def success(self):
+        with self.lock:
+            if self.failures >= self.failureThreshold:
+                print("Host " + self.host + " is reachable again")
+            self.failures = 0
+            self.probing = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.failures < self.failureThreshold:
+                return
+
+            if self.failures == self.failureThreshold:
+                print("Host " + self.host + " seems to be offline")
+
+            # random jitter, so probes of many hosts don't line up
+            delay = self.retryDelay * (2 ** min(self.failures - self.failureThreshold, 16))
+            delay = min(delay, self.maxRetryDelay)
+            self.retryTime = time.monotonic() + (delay * random.uniform(0.5, 1.0))
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+# OctoTray Linux Qt System Tray OctoPrint client
+#
+# DashboardWindow.py
+#
+# Table with the status of all configured printers,
+# fed by the central StatusPoller.
+
+import time
+from PyQt5 import QtWidgets
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QTableWidget, QTableWidgetItem, QHeaderView
+
+class DashboardWindow(QWidget):
+    columns = [ "Printer", "State", "Progress", "Tool", "Bed", "Time Left", "ETA" ]
+
+    def __init__(self, parent, *args, **kwargs):
+        super(DashboardWindow, self).__init__(*args, **kwargs)
+        self.parent = parent
+        self.poller = parent.poller
+
+        self.setWindowTitle(parent.name + " Dashboard")
+        self.setWindowIcon(parent.icon)
+
+        box = QVBoxLayout()
+        self.setLayout(box)
+
+        self.printers = [ p for p in parent.printers if p.api != None ]
+
+        self.table = QTableWidget(len(self.printers), len(self.columns))
+        self.table.setHorizontalHeaderLabels(self.columns)
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.table.cellDoubleClicked.connect(self.openWebcam)
+        box.addWidget(self.table, 1)
+
+        # items are created once and only changed later
+        for row in range(0, len(self.printers)):
+            for column in range(0, len(self.columns)):
+                self.table.setItem(row, column, QTableWidgetItem(""))
+            self.table.item(row, 0).setText(self.printers[row].host)
+            self.table.item(row, 1).setText("Unknown")
+
+            status = self.poller.getStatus(self.printers[row])
+            if status != None:
+                self.showStatus(row, status)
+
+        # faster updates while dashboard is open
+        self.poller.statusUpdated.connect(self.statusUpdated)
+        self.poller.setPeriod(parent.statusPollPeriod)
+
+    def statusUpdated(self, printer):
+        if printer not in self.printers:
+            return
+
+        status = self.poller.getStatus(printer)
+        if status != None:
+            self.showStatus(self.printers.index(printer), status)
+
+    # only used internally
+    def showStatus(self, row, status):
+        values = [ status["name"], status["state"], "", "", "", "", "" ]
+
+        if not status["reachable"]:
+            values[1] = "Offline"
+
+        if status["completion"] != None:
+            values[2] = "%.1f%%" % status["completion"]
+
+        for column, name in [ ( 3, "tool0" ), ( 4, "bed" ) ]:
+            if name in status["temperatures"]:
+                actual, target = status["temperatures"][name]
+                values[column] = "%.1f" % actual
+                if target != None:
+                    values[column] += " / %.1f" % target
+
+        if status["printTimeLeft"] != None:
+            values[5] = time.strftime("%H:%M:%S", time.gmtime(status["printTimeLeft"]))
+            values[6] = time.strftime("%H:%M", time.localtime(time.time() + status["printTimeLeft"]))
+
+        # only touch cells that changed, to avoid needless repaints
+        for column in range(0, len(values)):
+            item = self.table.item(row, column)
+            if item.text() != values[column]:
+                item.setText(values[column])
+
+    def openWebcam(self, row, column):
+        self.parent.printerWebcamAction(self.printers[row])
+
+    def closeEvent(self, event):
+        self.poller.statusUpdated.disconnect(self.statusUpdated)
+        self.poller.setPeriod(self.parent.statusPollPeriodIdle)
+        self.parent.removeDashboardWindow()
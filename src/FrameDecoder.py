@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+# OctoTray Linux Qt System Tray OctoPrint client
+#
+# FrameDecoder.py
+#
+# Decodes webcam JPEG frames and scales them to their
+# target size in worker threads, off the GUI thread.
+# Frames that did not change visibly are skipped.
+
+import zlib
+from PyQt5.QtCore import QObject, QBuffer, QIODevice, QSize, Qt, pyqtSignal
+from PyQt5.QtGui import QImage, QImageReader, QColorSpace
+
+class FrameDecoder(QObject):
+    # emitted in GUI thread with finished image
+    imageDecoded = pyqtSignal(QImage)
+
+    # frames are compared using tiny grayscale thumbnails
+    thumbnailSize = QSize(32, 32)
+    pixelThreshold = 24 # difference of one pixel to count as changed, 0...255
+    changeThreshold = 0.005 # share of changed pixels for a new frame
+
+    def __init__(self, tasks, *args, **kwargs):
+        super(FrameDecoder, self).__init__(*args, **kwargs)
+        self.tasks = tasks
+        self.busy = False
+
+        # describing the last processed frame
+        self.lastHash = None
+        self.pendingHash = None # of frame being processed
+        self.lastThumbnail = None
+        self.lastSize = None
+        self.lastFullResolution = None
+
+    # decode JPEG data and scale to fit size.
+    # unless fullResolution is set, the JPEG is decoded
+    # directly at reduced resolution near the target size.
+    # frames arriving while the previous one is still
+    # being processed are dropped, then False is returned.
+    def decode(self, data, size, fullResolution = False):
+        if self.busy:
+            return False
+
+        # the shown image is still valid for the same
+        # target size, so identical frames need no work at all
+        sameTarget = (size == self.lastSize) and (fullResolution == self.lastFullResolution)
+        frameHash = zlib.crc32(data)
+        if sameTarget and (frameHash == self.lastHash):
+            return True
+
+        self.pendingHash = frameHash
+        self.busy = True
+        self.tasks.run(self.decodeImage, self.decodeFinished, data, size, fullResolution, sameTarget)
+        return True
+
+    # only used internally, runs in worker thread
+    def thumbnail(self, data):
+        buf = QBuffer()
+        buf.setData(data)
+        buf.open(QIODevice.ReadOnly)
+
+        reader = QImageReader(buf)
+        reader.setScaledSize(self.thumbnailSize)
+        image = reader.read()
+        if image.isNull():
+            return None
+
+        image = image.convertToFormat(QImage.Format_Grayscale8)
+        bits = image.constBits()
+        bits.setsize(image.sizeInBytes())
+        return bytes(bits)
+
+    # only used internally, share of pixels that changed between two thumbnails.
+    # small local changes, like a moving toolhead, are not averaged away.
+    def difference(self, a, b):
+        if len(a) != len(b):
+            return 1.0
+        changed = sum(1 for x, y in zip(a, b) if abs(x - y) > self.pixelThreshold)
+        return changed / len(a)
+
+    # only used internally, runs in worker thread.
+    # returns None for errors or when frame has not changed.
+    def decodeImage(self, data, size, fullResolution, sameTarget):
+        try:
+            # cheap check with DCT-scaled decode before doing the full work
+            thumbnail = self.thumbnail(data)
+            if sameTarget and (thumbnail != None) and (self.lastThumbnail != None):
+                if self.difference(thumbnail, self.lastThumbnail) < self.changeThreshold:
+                    return None
+
+            buf = QBuffer()
+            buf.setData(data)
+            buf.open(QIODevice.ReadOnly)
+
+            reader = QImageReader(buf)
+            reader.setAutoTransform(True)
+
+            # JPEG plugin can downscale while decoding, which is
+            # much cheaper than decoding everything and scaling after
+            imageSize = reader.size()
+            if (not fullResolution) and imageSize.isValid() and (not size.isEmpty()):
+                if (imageSize.width() > size.width()) or (imageSize.height() > size.height()):
+                    reader.setScaledSize(imageSize.scaled(size, Qt.KeepAspectRatio))
+
+            image = reader.read()
+            if image.isNull():
+                print("Error decoding image: " + reader.errorString())
+                return None
+
+            if image.colorSpace().isValid():
+                image.convertToColorSpace(QColorSpace.SRgb)
+
+            if not size.isEmpty():
+                target = image.size().scaled(size, Qt.KeepAspectRatio)
+                if image.size() != target:
+                    image = image.scaled(target, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+
+            # only one frame is processed at a time, so no locking required
+            self.lastThumbnail = thumbnail
+            self.lastSize = size
+            self.lastFullResolution = fullResolution
+            return image
+        except Exception as e:
+            print("Error decoding image: " + str(e))
+            return None
+
+    # only used internally, runs in GUI thread
+    def decodeFinished(self, image):
+        self.busy = False
+        if image != None:
+            # only skip identical frames once one was really shown
+            self.lastHash = self.pendingHash
+            self.imageDecoded.emit(image)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+# OctoTray Linux Qt System Tray OctoPrint client
+#
+# HTTPConnectionPool.py
+#
+# Pool of persistent HTTP/1.1 keep-alive connections,
+# shared by all API requests to the same host.
+
+import http.client
+import select
+import socket
+import threading
+import time
+import urllib.parse
+
+class HTTPConnectionPool():
+    maxConnections = 4 # per host
+    idleTimeout = 30.0 # in s
+
+    # one pool for each host
+    pools = {}
+    poolsLock = threading.Lock()
+
+    def __init__(self, netloc):
+        self.netloc = netloc
+        self.idle = [] # tuples ( connection, time of last use )
+        self.count = 0 # idle and busy connections
+        self.condition = threading.Condition()
+
+    # shared pool for this host, created on first use
+    @classmethod
+    def forHost(cls, netloc):
+        with cls.poolsLock:
+            if netloc not in cls.pools:
+                cls.pools[netloc] = HTTPConnectionPool(netloc)
+            return cls.pools[netloc]
+
+    # returns tuple ( status, body ), raises socket.timeout,
+    # OSError or http.client.HTTPException on failure.
+    # like urllib, sends POST when data is given, otherwise GET.
+    # when reader is given, it is called with the response of successful
+    # requests to parse the body while it arrives. its result replaces body.
+    @classmethod
+    def request(cls, url, data, headers, timeout, reader = None):
+        u = urllib.parse.urlsplit(url)
+        path = u.path
+        if len(path) == 0:
+            path = "/"
+        if len(u.query) > 0:
+            path += "?" + u.query
+
+        method = "GET"
+        if data != None:
+            method = "POST"
+
+        return cls.forHost(u.netloc).send(method, path, data, headers, timeout, reader)
+
+    # only used internally
+    def send(self, method, path, data, headers, timeout, reader):
+        # a kept-alive connection may have been closed by the server in
+        # the meantime, so retry once on a fresh one. POSTs may already
+        # have been executed, so they are only retried when never sent.
+        for attempt in range(0, 2):
+            connection, reused = self.acquire(timeout)
+            sent = False
+            try:
+                connection.request(method, path, data, headers)
+                sent = True
+                response = connection.getresponse()
+                if (reader != None) and (response.status < 400):
+                    text = reader(response)
+
+                    # rest needs to be consumed to reuse connection
+                    response.read()
+                else:
+                    text = response.read()
+            except (ConnectionResetError, BrokenPipeError, http.client.BadStatusLine):
+                self.release(connection, False)
+                if reused:
+                    # server probably restarted, so other idle ones are stale, too
+                    self.dropIdle()
+                    if (attempt == 0) and ((method == "GET") or (not sent)):
+                        continue
+                raise
+            except Exception:
+                self.release(connection, False)
+                raise
+
+            self.release(connection, not response.will_close)
+            return (response.status, text)
+
+    # only used internally
+    def acquire(self, timeout):
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            self.evictIdle()
+            while True:
+                if len(self.idle) > 0:
+                    connection, lastUsed = self.idle.pop()
+                    if self.isDropped(connection):
+                        connection.close()
+                        self.count -= 1
+                        continue
+
+                    connection.timeout = timeout
+                    if connection.sock != None:
+                        connection.sock.settimeout(timeout)
+                    return (connection, True)
+
+                if self.count < self.maxConnections:
+                    self.count += 1
+                    return (http.client.HTTPConnection(self.netloc, timeout = timeout), False)
+
+                remaining = deadline - time.monotonic()
+                if (remaining <= 0) or not self.condition.wait(remaining):
+                    raise socket.timeout("no free connection to " + self.netloc)
+
+    # only used internally
+    def release(self, connection, reusable):
+        with self.condition:
+            if reusable:
+                self.idle.append((connection, time.monotonic()))
+            else:
+                connection.close()
+                self.count -= 1
+            self.evictIdle()
+            self.condition.notify()
+
+    # only used internally. an idle connection has nothing to
+    # read, unless the server has closed it in the meantime.
+    def isDropped(self, connection):
+        if connection.sock == None:
+            return True
+        try:
+            readable, writable, errors = select.select([ connection.sock ], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return len(readable) > 0
+
+    # only used internally
+    def dropIdle(self):
+        with self.condition:
+            for connection, lastUsed in self.idle:
+                connection.close()
+                self.count -= 1
+            self.idle = []
+            self.condition.notify_all()
+
+    # only used internally, with condition held
+    def evictIdle(self):
+        now = time.monotonic()
+        keep = []
+        for connection, lastUsed in self.idle:
+            if (now - lastUsed) > self.idleTimeout:
+                connection.close()
+                self.count -= 1
+            else:
+                keep.append((connection, lastUsed))
+        self.idle = keep
+
+    # close all idle connections of all hosts
+    @classmethod
+    def closeAll(cls):
+        with cls.poolsLock:
+            for pool in cls.pools.values():
+                pool.dropIdle()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+# OctoTray Linux Qt System Tray OctoPrint client
+#
+# HostProbe.py
+#
+# Cheap reachability check of a host with a plain TCP connect
+# and a short timeout. Probes only run in the background, requests
+# just check the cached result, so hosts known to be down fail immediately.
+
+import socket
+import threading
+import time
+import urllib.parse
+
+class HostProbe():
+    probeTimeout = 0.5 # in s
+    cacheTimeout = 30.0 # in s, longer than reachabilityInterval of OctoTray
+    defaultPort = 80
+
+    # one probe for each host
+    probes = {}
+    probesLock = threading.Lock()
+
+    def __init__(self, netloc):
+        self.netloc = netloc
+        self.lock = threading.Lock()
+        self.result = None
+        self.time = 0.0
+
+        # configured hosts may contain a port and a path, when behind a proxy
+        u = urllib.parse.urlsplit("http://" + netloc)
+        self.host = u.hostname or netloc
+        try:
+            self.port = u.port or self.defaultPort
+        except ValueError:
+            self.port = self.defaultPort
+
+    # shared probe for this host, created on first use
+    @classmethod
+    def forHost(cls, netloc):
+        with cls.probesLock:
+            if netloc not in cls.probes:
+                cls.probes[netloc] = HostProbe(netloc)
+            return cls.probes[netloc]
+
+    # cached result only, never blocks. unknown or outdated
+    # results count as reachable, so requests are still tried.
+    def isReachable(self):
+        with self.lock:
+            if (self.result == None) or ((time.monotonic() - self.time) >= self.cacheTimeout):
+                return True
+            return self.result
+
+    # blocks for up to probeTimeout, runs in worker thread
+    def probe(self):
+        try:
+            s = socket.create_connection((self.host, self.port), self.probeTimeout)
+            s.close()
+            result = True
+        except OSError:
+            result = False
+
+        with self.lock:
+            if result != self.result:
+                if result:
+                    print("Host " + self.netloc + " accepts connections")
+                else:
+                    print("Host " + self.netloc + " does not accept connections")
+
+            self.result = result
+            self.time = time.monotonic()
+        return result
+
+    # other requests have just reached the host
+    def reachable(self):
+        with self.lock:
+            self.result = True
+            self.time = time.monotonic()
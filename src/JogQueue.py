@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+# OctoTray Linux Qt System Tray OctoPrint client
+#
+# JogQueue.py
+#
+# Per-printer queue for jog moves. Consecutive moves on the same
+# axis are merged and sent from a worker thread, so the GUI stays
+# responsive while the printer catches up.
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+class JogQueue(QObject):
+    statusChanged = pyqtSignal(str)
+
+    mergeDelay = 150 # in ms
+
+    def __init__(self, parent, printer, *args, **kwargs):
+        super(JogQueue, self).__init__(*args, **kwargs)
+        self.parent = parent
+        self.printer = printer
+        self.pending = [] # lists [ axis, distance ]
+        self.running = [] # moves currently being sent
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.flush)
+
+    def addMove(self, axis, dist):
+        axis = axis.lower()
+        if (len(self.pending) > 0) and (self.pending[-1][0] == axis):
+            self.pending[-1][1] += dist
+        else:
+            self.pending.append([ axis, dist ])
+
+        # wait for more clicks before sending
+        self.timer.start(self.mergeDelay)
+        self.updateStatus()
+
+    def getStatus(self):
+        s = ""
+        if len(self.running) > 0:
+            s += "Jog: " + self.movesString(self.running) + " in flight"
+        if len(self.pending) > 0:
+            if len(s) > 0:
+                s += ", "
+            else:
+                s += "Jog: "
+            s += self.movesString(self.pending) + " queued"
+        return s
+
+    # only used internally
+    def movesString(self, moves):
+        return " ".join([ axis.upper() + str(dist) for axis, dist in moves ])
+
+    # only used internally
+    def updateStatus(self):
+        self.statusChanged.emit(self.getStatus())
+
+    # only used internally
+    def flush(self):
+        # next burst is sent when the current one is done
+        if (len(self.running) > 0) or (len(self.pending) == 0):
+            return
+
+        self.running = [ m for m in self.pending if m[1] != 0 ]
+        self.pending = []
+        if len(self.running) == 0:
+            self.updateStatus()
+            return
+
+        self.updateStatus()
+
+        # state safety check only once per burst
+        self.parent.tasks.run(self.printer.api.getState, self.stateReceived, error = self.movesFailed)
+
+    # only used internally
+    def stateReceived(self, state):
+        if self.printer.api.stateSafetyDialog(state, "move it"):
+            self.movesDone(None)
+            return
+
+        moves = [ (axis, dist) for axis, dist in self.running ]
+        self.parent.tasks.run(self.printer.api.callMoves, self.movesDone, moves, int(self.printer.jogSpeed), error = self.movesFailed)
+
+    # only used internally, burst is dropped so later moves still work
+    def movesFailed(self, error):
+        print("Error sending moves to " + self.printer.host + ": " + str(error))
+        self.movesDone(None)
+
+    # only used internally
+    def movesDone(self, result):
+        self.running = []
+        self.updateStatus()
+        self.flush()
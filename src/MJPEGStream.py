@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+# OctoTray Linux Qt System Tray OctoPrint client
+#
+# MJPEGStream.py
+#
+# Reads a multipart/x-mixed-replace MJPEG stream, like the ones
+# provided by mjpg-streamer and crowsnest with '?action=stream',
+# over one long-running connection and splits it into JPEG frames.
+# A source losing power often just goes quiet without closing the
+# connection, so missing frames are reported as an error, too.
+
+from PyQt5 import QtNetwork
+from PyQt5.QtCore import QObject, QUrl, QTimer, pyqtSignal
+
+class MJPEGStream(QObject):
+    frameReceived = pyqtSignal(bytes)
+    streamError = pyqtSignal(str)
+
+    maxBufferSize = 16 * 1024 * 1024 # in bytes
+    frameTimeout = 10 * 1000 # in ms, without frames until stream is given up
+
+    def __init__(self, manager, url, *args, **kwargs):
+        super(MJPEGStream, self).__init__(*args, **kwargs)
+        self.manager = manager
+        self.url = url
+        self.reply = None
+
+        self.watchdog = QTimer(self)
+        self.watchdog.setSingleShot(True)
+        self.watchdog.setInterval(self.frameTimeout)
+        self.watchdog.timeout.connect(self.frameTimedOut)
+
+    def start(self):
+        self.stop()
+
+        self.buffer = bytearray()
+        self.delimiter = None
+        self.frameLength = None
+
+        request = QtNetwork.QNetworkRequest(QUrl(self.url))
+        self.reply = self.manager.get(request)
+        self.reply.readyRead.connect(self.readData)
+        self.reply.finished.connect(self.streamFinished)
+        self.watchdog.start()
+
+    def stop(self):
+        self.watchdog.stop()
+        if self.reply != None:
+            reply = self.reply
+            self.reply = None
+            reply.readyRead.disconnect()
+            reply.finished.disconnect()
+            reply.abort()
+            reply.deleteLater()
+
+    def isRunning(self):
+        return self.reply != None
+
+    # only used internally
+    def streamFinished(self):
+        self.watchdog.stop()
+        reply = self.reply
+        self.reply = None
+        reply.deleteLater()
+
+        if reply.error() != QtNetwork.QNetworkReply.NoError:
+            self.streamError.emit(reply.errorString())
+        else:
+            self.streamError.emit("Stream has ended")
+
+    # only used internally
+    def readData(self):
+        if self.delimiter == None:
+            contentType = bytes(self.reply.rawHeader(b"Content-Type")).decode("ascii", "replace")
+            boundary = None
+            for param in contentType.split(";"):
+                param = param.strip()
+                if param.lower().startswith("boundary="):
+                    boundary = param[len("boundary="):].strip('"')
+
+            if (boundary == None) or (not contentType.lower().startswith("multipart/")):
+                self.stop()
+                self.streamError.emit("Not a multipart stream: \"" + contentType + "\"")
+                return
+
+            if not boundary.startswith("--"):
+                boundary = "--" + boundary
+            self.delimiter = boundary.encode("ascii")
+
+        self.buffer += bytes(self.reply.readAll())
+        if len(self.buffer) > self.maxBufferSize:
+            self.stop()
+            self.streamError.emit("No frame boundary found in stream")
+            return
+
+        # when multiple frames arrived at once, only show the newest one
+        frame = None
+        while True:
+            f = self.nextFrame()
+            if f == None:
+                break
+            frame = f
+
+        if frame != None:
+            self.watchdog.start()
+            self.frameReceived.emit(frame)
+
+    # only used internally
+    def frameTimedOut(self):
+        self.stop()
+        self.streamError.emit("No frame received for %d s" % (self.frameTimeout / 1000))
+
+    # only used internally, returns bytes of next complete frame or None
+    def nextFrame(self):
+        if self.frameLength == None:
+            # find part headers following boundary
+            start = self.buffer.find(self.delimiter)
+            if start < 0:
+                # keep only what could be the start of a boundary
+                del self.buffer[:max(0, len(self.buffer) - len(self.delimiter))]
+                return None
+
+            headerEnd = self.buffer.find(b"\r\n\r\n", start)
+            if headerEnd < 0:
+                del self.buffer[:start]
+                return None
+
+            # part without Content-Length ends at the next boundary
+            self.frameLength = -1
+            headers = bytes(self.buffer[start + len(self.delimiter):headerEnd]).decode("ascii", "replace")
+            for line in headers.split("\r\n"):
+                name, sep, value = line.partition(":")
+                if name.strip().lower() == "content-length":
+                    try:
+                        self.frameLength = int(value.strip())
+                    except ValueError:
+                        pass
+
+            del self.buffer[:headerEnd + 4]
+
+        if self.frameLength >= 0:
+            if len(self.buffer) < self.frameLength:
+                return None
+            frame = bytes(self.buffer[:self.frameLength])
+            del self.buffer[:self.frameLength]
+        else:
+            end = self.buffer.find(self.delimiter)
+            if end < 0:
+                return None
+            frame = bytes(self.buffer[:end]).rstrip(b"\r\n")
+            del self.buffer[:end]
+
+        self.frameLength = None
+        return frame
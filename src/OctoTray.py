@@ -7,17 +7,26 @@
 # Main application logic.
 
 import sys
+import time
 from os import path
 from PyQt5 import QtNetwork
 from PyQt5.QtWidgets import QSystemTrayIcon, QAction, QMenu, QMessageBox, QDesktopWidget
-from PyQt5.QtGui import QIcon, QPixmap, QDesktopServices, QCursor
-from PyQt5.QtCore import QCoreApplication, QSettings, QUrl
+from PyQt5.QtGui import QIcon, QPixmap, QDesktopServices, QCursor, QPainter, QColor, QFont
+from PyQt5.QtCore import QCoreApplication, QSettings, QUrl, QTimer, QRectF, Qt
 from CamWindow import CamWindow
+from CamGridWindow import CamGridWindow
+from DashboardWindow import DashboardWindow
 from SettingsWindow import SettingsWindow
 from SettingsWindow import Printer
 from MainWindow import MainWindow
 from APIOctoprint import APIOctoprint
 from APIMoonraker import APIMoonraker
+from TaskRunner import TaskRunner
+from JogQueue import JogQueue
+from CapabilityCache import CapabilityCache
+from StatusPoller import StatusPoller
+from StatusWatcher import StatusWatcher
+from HTTPConnectionPool import HTTPConnectionPool
 
 class OctoTray():
     name = "OctoTray"
@@ -35,11 +44,23 @@ class OctoTray():
     ]
 
     networkTimeout = 2.0 # in s
+    workerThreads = 16 # parallel network requests
+    decodeThreads = 4 # parallel webcam image decoding
+    stateCacheTimeout = 1.0 # in s
+    pushUpdates = True # use push API where available
+    recentFilesCount = 10
+    recentFilesTimeout = 60.0 # in s
+    statusPollPeriod = 5.0 # in s, for all printers together
+    statusPollPeriodIdle = 30.0 # in s, when only tray shows status
+    trayUpdateDelay = 5000 # in ms, limits tray repaints
+    reachabilityInterval = 10 * 1000 # in ms
 
     # list of Printer objects
     printers = []
 
     camWindows = []
+    camGridWindow = None
+    dashboardWindow = None
     settingsWindow = None
 
     # default, can be overridden in config
@@ -55,105 +76,43 @@ class OctoTray():
         self.menu = QMenu()
         self.printers = self.readSettings()
 
-        unknownCount = 0
-        for p in self.printers:
-            p.menus = []
-
-            if p.apiType.lower() == "octoprint":
-                p.api = APIOctoprint(self, p.host, p.key)
-            elif p.apiType.lower() == "moonraker":
-                p.api = APIMoonraker(self, p.host, p.webcam)
-            else:
-                print("Unsupported API type " + p.apiType)
-                unknownCount += 1
-                action = QAction(p.host)
-                action.setEnabled(False)
-                p.menus.append(action)
-                self.menu.addAction(action)
-                continue
+        # discovery of all printers runs in parallel,
+        # menus are filled in as each printer answers
+        self.tasks = TaskRunner(self.workerThreads)
 
-            commands = p.api.getAvailableCommands()
+        # separate pool, so image decoding never waits for the network
+        self.decodeTasks = TaskRunner(self.decodeThreads)
 
-            # don't populate menu when no methods are available
-            if len(commands) == 0:
-                unknownCount += 1
-                action = QAction(p.host)
-                action.setEnabled(False)
-                p.menus.append(action)
-                self.menu.addAction(action)
-                continue
+        # capabilities from last run, checked again in background
+        self.capabilities = CapabilityCache()
 
-            # top level menu for this printer
-            menu = QMenu(p.api.getName())
-            p.menus.append(menu)
-            self.menu.addMenu(menu)
-
-            # create action for all available commands
-            for cmd in commands:
-                name, func = cmd
-                action = QAction(name)
-                action.triggered.connect(lambda chk, n=name, f=func: f(n))
-                p.menus.append(action)
-                menu.addAction(action)
-
-            if (p.tempTool != None) or (p.tempBed != None):
-                menu.addSeparator()
-
-            if p.tempTool != None:
-                action = QAction("Preheat Tool")
-                action.triggered.connect(lambda chk, p=p: p.api.printerHeatTool(p.tempTool))
-                p.menus.append(action)
-                menu.addAction(action)
-
-            if p.tempBed != None:
-                action = QAction("Preheat Bed")
-                action.triggered.connect(lambda chk, p=p: p.api.printerHeatBed(p.tempBed))
-                p.menus.append(action)
-                menu.addAction(action)
-
-            if (p.tempTool != None) or (p.tempBed != None):
-                action = QAction("Cooldown")
-                action.triggered.connect(lambda chk, p=p: p.api.printerCooldown())
-                p.menus.append(action)
-                menu.addAction(action)
+        # status of all printers for overview windows
+        self.poller = StatusPoller(self)
 
-            menu.addSeparator()
+        # notifications about changes in printer status
+        self.watcher = StatusWatcher(self)
 
-            fileMenu = QMenu("Recent Files")
-            p.menus.append(fileMenu)
-            menu.addMenu(fileMenu)
-
-            files = p.api.getRecentFiles(10)
-            for f in files:
-                fileName, filePath = f
-                action = QAction(fileName)
-                action.triggered.connect(lambda chk, p=p, f=filePath: p.api.printFile(f))
-                p.menus.append(action)
-                fileMenu.addAction(action)
-
-            action = QAction("Get Status")
-            action.triggered.connect(lambda chk, p=p: p.api.statusDialog())
-            p.menus.append(action)
-            menu.addAction(action)
+        for p in self.printers:
+            self.setupPrinter(p)
+            self.menu.addMenu(p.menu)
 
-            action = QAction("Show Webcam")
-            action.triggered.connect(lambda chk, x=p: self.printerWebcamAction(x))
-            p.menus.append(action)
-            menu.addAction(action)
+        # printer menus are inserted before this when reloading
+        self.printerSeparator = self.menu.addSeparator()
 
-            action = QAction("Open Web UI")
-            action.triggered.connect(lambda chk, x=p: self.printerWebAction(x))
-            p.menus.append(action)
-            menu.addAction(action)
+        self.camGridAction = QAction("&Webcam Grid")
+        self.camGridAction.triggered.connect(self.showCamGridAction)
+        self.menu.addAction(self.camGridAction)
 
-        self.menu.addSeparator()
+        self.dashboardAction = QAction("&Dashboard")
+        self.dashboardAction.triggered.connect(self.showDashboardAction)
+        self.menu.addAction(self.dashboardAction)
 
         self.settingsAction = QAction("&Settings")
         self.settingsAction.triggered.connect(self.showSettingsAction)
         self.menu.addAction(self.settingsAction)
 
         self.refreshAction = QAction("&Refresh")
-        self.refreshAction.triggered.connect(self.restartApp)
+        self.refreshAction.triggered.connect(self.refresh)
         self.menu.addAction(self.refreshAction)
 
         self.quitAction = QAction("&Quit")
@@ -180,6 +139,13 @@ class OctoTray():
             self.trayIcon.setContextMenu(self.menu)
             self.trayIcon.activated.connect(self.showHide)
             self.trayIcon.setVisible(True)
+
+            # summary of all printers in tooltip and icon
+            self.trayBadge = None
+            self.trayTimer = QTimer()
+            self.trayTimer.setSingleShot(True)
+            self.trayTimer.timeout.connect(self.updateTrayStatus)
+            self.poller.statusUpdated.connect(self.trayStatusChanged)
         else:
             self.mainWindow = MainWindow(self)
             self.mainWindow.show()
@@ -191,6 +157,376 @@ class OctoTray():
             y += screenGeometry.y()
             self.mainWindow.setGeometry(int(x), int(y), int(self.mainWindow.width()), int(self.mainWindow.height()))
 
+        # slow background polling, faster while dashboard is open
+        self.poller.start()
+
+        # unreachable printers are greyed out in the menu
+        self.reachabilityTimer = QTimer()
+        self.reachabilityTimer.timeout.connect(self.checkReachability)
+        self.reachabilityTimer.start(self.reachabilityInterval)
+        self.checkReachability()
+
+    # creates API objects and menu of a new printer
+    def setupPrinter(self, p):
+        p.menus = []
+        p.fileMenu = None
+        p.fileActions = []
+        p.reachable = True # until probe says otherwise
+
+        # fetched when the menu is first opened, list of ( name, path )
+        p.recentFiles = None
+        p.recentFilesTime = 0.0
+        p.recentFilesLoading = False
+
+        # placeholder until printer has been discovered
+        p.menu = QMenu(p.host)
+        p.menu.setEnabled(False)
+
+        if p.apiType.lower() == "octoprint":
+            p.api = APIOctoprint(self, p.host, p.key)
+        elif p.apiType.lower() == "moonraker":
+            p.api = APIMoonraker(self, p.host, p.webcam)
+        else:
+            print("Unsupported API type " + p.apiType)
+            p.api = None
+            return
+
+        # moves from webcam windows are merged and sent in background
+        p.jogQueue = JogQueue(self, p)
+
+        cached = self.capabilities.get(p)
+        if cached != None:
+            p.api.setCapabilities(cached)
+            self.populatePrinterMenu(p)
+
+        self.tasks.run(self.discoverPrinter, self.updatePrinterCapabilities, p, cached, self.capabilities.isExpired(p))
+
+    # stops everything belonging to a printer no longer configured
+    def removePrinter(self, p):
+        for cw in [ cw for cw in self.camWindows if cw.printer == p ]:
+            cw.close()
+
+        if p.api != None:
+            p.api.stopPush()
+
+        self.menu.removeAction(p.menu.menuAction())
+        p.menu.clear()
+        p.menus = []
+        p.fileMenu = None
+
+    # printers are the same as long as the API objects stay valid
+    def printerIdentity(self, p):
+        return (p.apiType.lower(), p.host, p.key, p.webcam)
+
+    # apply changed settings without restarting.
+    # only new or changed printers are probed.
+    def reloadSettings(self):
+        oldPrinters = list(self.printers)
+        printers = []
+        added = False
+
+        for new in self.readSettings():
+            old = next((p for p in oldPrinters if self.printerIdentity(p) == self.printerIdentity(new)), None)
+            if old == None:
+                self.setupPrinter(new)
+                printers.append(new)
+                added = True
+                continue
+
+            # keep API, caches and windows, only take over simple settings.
+            # actions read these when triggered, so menu stays valid.
+            oldPrinters.remove(old)
+            oldPreheat = ( old.tempTool != None, old.tempBed != None )
+            old.apiType = new.apiType
+            old.tempTool = new.tempTool
+            old.tempBed = new.tempBed
+            old.jogSpeed = new.jogSpeed
+            old.jogLength = new.jogLength
+            printers.append(old)
+
+            # only rebuild when preheat entries appear or vanish
+            newPreheat = ( old.tempTool != None, old.tempBed != None )
+            if (old.api != None) and (len(old.menus) > 0) and (newPreheat != oldPreheat):
+                self.populatePrinterMenu(old)
+
+        for p in oldPrinters:
+            self.removePrinter(p)
+
+        self.printers = printers
+
+        # menus in new order, before the global actions
+        for p in self.printers:
+            self.menu.removeAction(p.menu.menuAction())
+            self.menu.insertMenu(self.printerSeparator, p.menu)
+
+        # grid and dashboard have one entry per printer
+        if added or (len(oldPrinters) > 0):
+            if self.camGridWindow != None:
+                self.camGridWindow.close()
+                self.showCamGridAction()
+
+            if self.dashboardWindow != None:
+                self.dashboardWindow.close()
+                self.showDashboardAction()
+
+    # reload settings and probe all printers again in background
+    def refresh(self):
+        self.reloadSettings()
+
+        for p in self.printers:
+            if p.api != None:
+                self.tasks.run(self.discoverPrinter, self.updatePrinterCapabilities, p, self.capabilities.get(p), True)
+
+    def checkReachability(self):
+        for p in self.printers:
+            if p.api != None:
+                self.tasks.run(self.probePrinter, self.showReachability, p)
+
+    # runs in worker thread
+    def probePrinter(self, p):
+        return (p, p.api.probeReachable())
+
+    # runs in GUI thread
+    def showReachability(self, result):
+        p, reachable = result
+        if (p not in self.printers) or (reachable == p.reachable):
+            return
+
+        p.reachable = reachable
+
+        # printer may have been offline during discovery
+        if reachable and (len(p.menus) == 0):
+            self.tasks.run(self.discoverPrinter, self.updatePrinterCapabilities, p, self.capabilities.get(p), True)
+
+        # menus without any commands stay disabled
+        p.menu.setEnabled(reachable and (len(p.menus) > 0))
+
+    # runs in worker thread.
+    # returns capabilities or None when cached ones are still valid.
+    def discoverPrinter(self, p, cached, expired):
+        version = p.api.getVersion()
+        if version == None:
+            # not reachable, keep what we know
+            return (p, None)
+
+        # no commands may just mean the API key was wrong, so always check again
+        if (cached != None) and (not expired) and (cached.get("version") == version) and (cached.get("method") != "unknown"):
+            return (p, None)
+
+        capabilities = p.api.getCapabilities()
+        capabilities["version"] = version
+        return (p, capabilities)
+
+    # runs in GUI thread
+    def updatePrinterCapabilities(self, result):
+        p, capabilities = result
+        if (capabilities == None) or (p not in self.printers):
+            return
+
+        cached = self.capabilities.get(p)
+        self.capabilities.set(p, capabilities)
+
+        # only rebuild menu when something has changed
+        if capabilities != cached:
+            p.api.setCapabilities(capabilities)
+            self.populatePrinterMenu(p)
+
+    # also used to rebuild the menu of a printer
+    def populatePrinterMenu(self, p):
+        menu = p.menu
+        menu.clear()
+        p.menus = []
+        p.fileMenu = None
+
+        # don't populate menu when no methods are available
+        commands = p.api.getAvailableCommands()
+        if len(commands) == 0:
+            menu.setTitle(p.host)
+            menu.setEnabled(False)
+            return
+
+        menu.setTitle(p.api.getName())
+        menu.setEnabled(p.reachable)
+
+        if self.pushUpdates:
+            p.api.startPush()
+
+        # create action for all available commands
+        for cmd in commands:
+            name, func = cmd
+            action = QAction(name)
+            action.triggered.connect(lambda chk, n=name, f=func: f(n))
+            p.menus.append(action)
+            menu.addAction(action)
+
+        if (p.tempTool != None) or (p.tempBed != None):
+            menu.addSeparator()
+
+        if p.tempTool != None:
+            action = QAction("Preheat Tool")
+            action.triggered.connect(lambda chk, p=p: p.api.printerHeatTool(p.tempTool))
+            p.menus.append(action)
+            menu.addAction(action)
+
+        if p.tempBed != None:
+            action = QAction("Preheat Bed")
+            action.triggered.connect(lambda chk, p=p: p.api.printerHeatBed(p.tempBed))
+            p.menus.append(action)
+            menu.addAction(action)
+
+        if (p.tempTool != None) or (p.tempBed != None):
+            action = QAction("Cooldown")
+            action.triggered.connect(lambda chk, p=p: p.api.printerCooldown())
+            p.menus.append(action)
+            menu.addAction(action)
+
+        menu.addSeparator()
+
+        # file listing can be large, so only fetch it when needed
+        p.fileMenu = QMenu("Recent Files")
+        p.fileMenu.aboutToShow.connect(lambda p=p: self.showFileMenu(p))
+        p.menus.append(p.fileMenu)
+        menu.addMenu(p.fileMenu)
+
+        action = QAction("Get Status")
+        action.triggered.connect(lambda chk, p=p: p.api.statusDialog())
+        p.menus.append(action)
+        menu.addAction(action)
+
+        action = QAction("Show Webcam")
+        action.triggered.connect(lambda chk, x=p: self.printerWebcamAction(x))
+        p.menus.append(action)
+        menu.addAction(action)
+
+        action = QAction("Open Web UI")
+        action.triggered.connect(lambda chk, x=p: self.printerWebAction(x))
+        p.menus.append(action)
+        menu.addAction(action)
+
+    # shows cached files immediately, refreshes them in background when too old
+    def showFileMenu(self, p):
+        self.fillFileMenu(p)
+
+        if p.recentFilesLoading:
+            return
+
+        if (p.recentFiles == None) or ((time.monotonic() - p.recentFilesTime) > self.recentFilesTimeout):
+            p.recentFilesLoading = True
+            self.tasks.run(self.fetchRecentFiles, self.updateRecentFiles, p, error = lambda e, p=p: self.recentFilesFailed(p))
+
+    # only used internally
+    def fillFileMenu(self, p):
+        if p.fileMenu == None:
+            return
+
+        p.fileMenu.clear()
+        p.fileActions = []
+
+        if p.recentFiles == None:
+            action = QAction("Loading...")
+            action.setEnabled(False)
+            p.fileActions.append(action)
+            p.fileMenu.addAction(action)
+            return
+
+        for f in p.recentFiles:
+            fileName, filePath = f
+            action = QAction(fileName)
+            action.triggered.connect(lambda chk, p=p, f=filePath: p.api.printFile(f))
+            p.fileActions.append(action)
+            p.fileMenu.addAction(action)
+
+    # runs in worker thread
+    def fetchRecentFiles(self, p):
+        return (p, p.api.getRecentFiles(self.recentFilesCount))
+
+    # runs in GUI thread, next opening of menu tries again
+    def recentFilesFailed(self, p):
+        p.recentFilesLoading = False
+
+    # runs in GUI thread
+    def updateRecentFiles(self, result):
+        p, files = result
+        p.recentFilesLoading = False
+        p.recentFiles = files
+        p.recentFilesTime = time.monotonic()
+
+        # menu may be open already
+        self.fillFileMenu(p)
+
+    # status changes arrive one printer at a time,
+    # so the tray is only updated after a delay
+    def trayStatusChanged(self, printer):
+        if not self.trayTimer.isActive():
+            self.trayTimer.start(self.trayUpdateDelay)
+
+    # only used internally
+    def updateTrayStatus(self):
+        printing = 0
+        errors = 0
+        timeLeft = None
+        for p in self.printers:
+            status = self.poller.getStatus(p)
+            if status == None:
+                continue
+
+            state = status["state"].lower()
+            if state.startswith("printing"):
+                printing += 1
+                if (status["printTimeLeft"] != None) and ((timeLeft == None) or (status["printTimeLeft"] < timeLeft)):
+                    timeLeft = status["printTimeLeft"]
+            elif "error" in state:
+                errors += 1
+
+        s = self.name + " " + self.version
+        if printing > 0:
+            s += "\n" + str(printing) + " printing"
+            if timeLeft != None:
+                s += ", next done in " + time.strftime("%H:%M:%S", time.gmtime(timeLeft))
+        if errors > 0:
+            s += "\n" + str(errors) + " with errors"
+
+        # avoid repaints of the desktop shell when nothing changed
+        if s != self.trayIcon.toolTip():
+            self.trayIcon.setToolTip(s)
+
+        badge = (printing, errors)
+        if badge != self.trayBadge:
+            self.trayBadge = badge
+            self.trayIcon.setIcon(self.badgeIcon(printing, errors))
+
+    # only used internally, tray icon with number of printing printers.
+    # red when a printer has an error.
+    def badgeIcon(self, printing, errors):
+        if (printing == 0) and (errors == 0):
+            return self.icon
+
+        pic = self.pic.copy()
+        size = min(pic.width(), pic.height()) * 0.55
+        rect = QRectF(pic.width() - size, pic.height() - size, size, size)
+
+        text = str(printing)
+        color = QColor(0, 150, 0)
+        if errors > 0:
+            text = "!"
+            color = QColor(200, 0, 0)
+
+        painter = QPainter(pic)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(color)
+        painter.drawEllipse(rect)
+
+        font = QFont()
+        font.setBold(True)
+        font.setPixelSize(max(1, int(size * 0.7)))
+        painter.setFont(font)
+        painter.setPen(QColor(255, 255, 255))
+        painter.drawText(rect, Qt.AlignCenter, text)
+        painter.end()
+
+        return QIcon(pic)
+
     def showHide(self, activationReason):
         if activationReason == QSystemTrayIcon.Trigger:
             self.menu.popup(QCursor.pos())
@@ -285,7 +621,18 @@ class OctoTray():
         else:
             return False
 
+    def showNotification(self, title, text, warning = False):
+        print(title + ": " + text)
+
+        if self.inSysTray:
+            icon = QSystemTrayIcon.Information
+            if warning:
+                icon = QSystemTrayIcon.Warning
+            self.trayIcon.showMessage(title, text, icon)
+
     def exit(self):
+        self.closeAll()
+        HTTPConnectionPool.closeAll()
         QCoreApplication.quit()
 
     def printerWebAction(self, item):
@@ -314,6 +661,46 @@ class OctoTray():
     def removeWebcamWindow(self, window):
         self.camWindows.remove(window)
 
+    def showCamGridAction(self):
+        if self.camGridWindow != None:
+            self.camGridWindow.show()
+            self.camGridWindow.activateWindow()
+            return
+
+        self.camGridWindow = CamGridWindow(self)
+        self.camGridWindow.show()
+        self.camGridWindow.activateWindow()
+
+        screenGeometry = QDesktopWidget().screenGeometry()
+        width = int(screenGeometry.width() * 3 / 4)
+        height = int(screenGeometry.height() * 3 / 4)
+        x = screenGeometry.x() + (screenGeometry.width() - width) / 2
+        y = screenGeometry.y() + (screenGeometry.height() - height) / 2
+        self.camGridWindow.setGeometry(int(x), int(y), width, height)
+
+    def removeCamGridWindow(self):
+        self.camGridWindow = None
+
+    def showDashboardAction(self):
+        if self.dashboardWindow != None:
+            self.dashboardWindow.show()
+            self.dashboardWindow.activateWindow()
+            return
+
+        self.dashboardWindow = DashboardWindow(self)
+        self.dashboardWindow.show()
+        self.dashboardWindow.activateWindow()
+
+        screenGeometry = QDesktopWidget().screenGeometry()
+        width = int(screenGeometry.width() / 2)
+        height = int(screenGeometry.height() / 2)
+        x = screenGeometry.x() + (screenGeometry.width() - width) / 2
+        y = screenGeometry.y() + (screenGeometry.height() - height) / 2
+        self.dashboardWindow.setGeometry(int(x), int(y), width, height)
+
+    def removeDashboardWindow(self):
+        self.dashboardWindow = None
+
     def showSettingsAction(self):
         if self.settingsWindow != None:
             self.settingsWindow.show()
@@ -334,17 +721,31 @@ class OctoTray():
     def removeSettingsWindow(self):
         self.settingsWindow = None
 
-    def restartApp(self):
-        QCoreApplication.exit(42)
-
     def closeAll(self):
-        for cw in self.camWindows:
+        self.reachabilityTimer.stop()
+        self.poller.stop()
+        self.tasks.stop()
+        self.decodeTasks.stop()
+
+        for p in self.printers:
+            if p.api != None:
+                p.api.stopPush()
+
+        # closing windows removes them from the list
+        for cw in list(self.camWindows):
             cw.close()
 
+        if self.camGridWindow != None:
+            self.camGridWindow.close()
+
+        if self.dashboardWindow != None:
+            self.dashboardWindow.close()
+
         if self.settingsWindow != None:
             self.settingsWindow.close()
 
         if self.inSysTray:
+            self.trayTimer.stop()
             self.trayIcon.setVisible(False)
         else:
             self.mainWindow.setVisible(False)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+# OctoTray Linux Qt System Tray OctoPrint client
+#
+# PushMoonraker.py
+#
+# Live printer object status from Moonraker, subscribed
+# over its JSON-RPC websocket. Only changed fields are pushed.
+#
+# see also:
+# https://moonraker.readthedocs.io/en/latest/web_api/#subscribe-to-printer-objects
+
+import json
+import time
+from PyQt5.QtCore import QObject, QTimer, QUrl
+
+try:
+    from PyQt5.QtWebSockets import QWebSocket
+except ImportError:
+    QWebSocket = None
+
+class PushMoonraker(QObject):
+    reconnectDelay = 10 * 1000 # in ms
+    keepaliveInterval = 10 * 1000 # in ms
+    keepaliveTimeout = 30.0 # in s
+
+
+    def __init__(self, api, *args, **kwargs):
+        super(PushMoonraker, self).__init__(*args, **kwargs)
+        self.api = api
+        self.running = False
+        self.socket = None
+        self.requestId = 0
+        self.subscribeId = None
+        self.lastMessage = 0
+
+        # printer object name -> dict of fields
+        self.status = None
+
+        self.reconnectTimer = QTimer(self)
+        self.reconnectTimer.setSingleShot(True)
+        self.reconnectTimer.timeout.connect(self.open)
+
+        self.keepaliveTimer = QTimer(self)
+        self.keepaliveTimer.setInterval(self.keepaliveInterval)
+        self.keepaliveTimer.timeout.connect(self.keepalive)
+
+    # websockets may be missing from the PyQt5 installation
+    @staticmethod
+    def available():
+        return QWebSocket != None
+
+    def start(self):
+        if self.running or not self.available():
+            return
+        self.running = True
+        self.open()
+
+    def stop(self):
+        self.running = False
+        self.reconnectTimer.stop()
+        self.keepaliveTimer.stop()
+        self.status = None
+        if self.socket != None:
+            self.socket.abort()
+            self.socket = None
+
+    # true when the local state can be used instead of polling
+    def isValid(self):
+        if self.status == None:
+            return False
+        return (time.monotonic() - self.lastMessage) < self.keepaliveTimeout
+
+    # only used internally
+    def open(self):
+        if not self.running:
+            return
+
+        self.socket = QWebSocket()
+        self.socket.connected.connect(self.socketConnected)
+        self.socket.disconnected.connect(self.socketDisconnected)
+        self.socket.textMessageReceived.connect(self.messageReceived)
+        self.socket.pong.connect(self.pongReceived)
+        self.socket.open(QUrl("ws://" + self.api.host + "/websocket"))
+
+    # only used internally
+    def sendCommand(self, method, params):
+        self.requestId += 1
+        msg = {
+            "jsonrpc": "2.0",
+            "method": method,
+            "params": params,
+            "id": self.requestId
+        }
+        self.socket.sendTextMessage(json.dumps(msg))
+        return self.requestId
+
+    # only used internally
+    def subscribe(self):
+        objects = {}
+        for o in self.api.statusObjects:
+            objects[o] = None
+        self.subscribeId = self.sendCommand("printer.objects.subscribe", { "objects": objects })
+
+    # only used internally
+    def socketConnected(self):
+        print("Push connection to Moonraker " + self.api.host + " established")
+        self.lastMessage = time.monotonic()
+        self.keepaliveTimer.start()
+        self.subscribe()
+
+    # only used internally
+    def socketDisconnected(self):
+        print("Push connection to Moonraker " + self.api.host + " lost")
+        self.keepaliveTimer.stop()
+        self.status = None
+        if self.socket != None:
+            self.socket.deleteLater()
+            self.socket = None
+        if self.running:
+            self.reconnectTimer.start(self.reconnectDelay)
+
+    # only used internally
+    def keepalive(self):
+        if (time.monotonic() - self.lastMessage) > self.keepaliveTimeout:
+            print("Push connection to Moonraker " + self.api.host + " timed out")
+            self.socket.abort()
+        else:
+            self.socket.ping()
+
+    # only used internally
+    def pongReceived(self, elapsed, payload):
+        self.lastMessage = time.monotonic()
+
+    # only used internally
+    def messageReceived(self, text):
+        self.lastMessage = time.monotonic()
+
+        try:
+            msg = json.loads(text)
+        except json.JSONDecodeError:
+            return
+
+        if ("id" in msg) and (msg["id"] == self.subscribeId):
+            if ("result" in msg) and ("status" in msg["result"]):
+                self.status = msg["result"]["status"]
+            return
+
+        if not "method" in msg:
+            return
+
+        if msg["method"] == "notify_status_update":
+            if (self.status != None) and ("params" in msg) and (len(msg["params"]) > 0):
+                self.update(msg["params"][0])
+        elif msg["method"] == "notify_klippy_ready":
+            # subscriptions are lost when klippy restarts
+            self.subscribe()
+        elif msg["method"] in [ "notify_klippy_shutdown", "notify_klippy_disconnected" ]:
+            self.status = None
+
+    # only used internally
+    def update(self, changes):
+        # readers in other threads keep their old copy
+        status = dict(self.status)
+        for name, fields in changes.items():
+            if name in status:
+                merged = dict(status[name])
+                merged.update(fields)
+                status[name] = merged
+            else:
+                status[name] = fields
+        self.status = status
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+# OctoTray Linux Qt System Tray OctoPrint client
+#
+# PushOctoprint.py
+#
+# Live printer state pushed by OctoPrint over its SockJS websocket.
+# Keeps the same data as /api/job and /api/printer up to date locally.
+#
+# see also:
+# https://docs.octoprint.org/en/master/api/push.html
+
+import json
+import time
+from PyQt5.QtCore import QObject, QTimer, QUrl
+
+try:
+    from PyQt5.QtWebSockets import QWebSocket
+except ImportError:
+    QWebSocket = None
+
+class PushOctoprint(QObject):
+    reconnectDelay = 10 * 1000 # in ms
+    keepaliveInterval = 10 * 1000 # in ms
+    keepaliveTimeout = 30.0 # in s
+
+    def __init__(self, api, *args, **kwargs):
+        super(PushOctoprint, self).__init__(*args, **kwargs)
+        self.api = api
+        self.running = False
+        self.socket = None
+        self.authenticated = False
+        self.lastMessage = 0
+
+        # same structure as parsed /api/job and /api/printer
+        self.jobState = None
+        self.printerState = None
+
+        self.reconnectTimer = QTimer(self)
+        self.reconnectTimer.setSingleShot(True)
+        self.reconnectTimer.timeout.connect(self.login)
+
+        self.keepaliveTimer = QTimer(self)
+        self.keepaliveTimer.setInterval(self.keepaliveInterval)
+        self.keepaliveTimer.timeout.connect(self.keepalive)
+
+    # websockets may be missing from the PyQt5 installation
+    @staticmethod
+    def available():
+        return QWebSocket != None
+
+    def start(self):
+        if self.running or not self.available():
+            return
+        self.running = True
+        self.login()
+
+    def stop(self):
+        self.running = False
+        self.reconnectTimer.stop()
+        self.keepaliveTimer.stop()
+        self.reset()
+        if self.socket != None:
+            self.socket.abort()
+            self.socket = None
+
+    # true when the local state can be used instead of polling
+    def isValid(self):
+        if (not self.authenticated) or (self.jobState == None) or (self.printerState == None):
+            return False
+        return (time.monotonic() - self.lastMessage) < self.keepaliveTimeout
+
+    # only used internally
+    def reset(self):
+        self.authenticated = False
+        self.jobState = None
+        self.printerState = None
+
+    # only used internally
+    def login(self):
+        if self.running:
+            # session for websocket auth needs blocking HTTP request
+            self.api.parent.tasks.run(self.api.getSession, self.open, error = lambda e: self.open(None))
+
+    # only used internally
+    def open(self, session):
+        if not self.running:
+            return
+
+        if session == None:
+            self.reconnectTimer.start(self.reconnectDelay)
+            return
+
+        self.session = session
+        self.socket = QWebSocket()
+        self.socket.connected.connect(self.socketConnected)
+        self.socket.disconnected.connect(self.socketDisconnected)
+        self.socket.textMessageReceived.connect(self.messageReceived)
+        self.socket.pong.connect(self.pongReceived)
+        self.socket.open(QUrl("ws://" + self.api.host + "/sockjs/websocket"))
+
+    # only used internally
+    def socketConnected(self):
+        print("Push connection to OctoPrint " + self.api.host + " established")
+        self.lastMessage = time.monotonic()
+        self.keepaliveTimer.start()
+
+    # only used internally
+    def socketDisconnected(self):
+        print("Push connection to OctoPrint " + self.api.host + " lost")
+        self.keepaliveTimer.stop()
+        self.reset()
+        if self.socket != None:
+            self.socket.deleteLater()
+            self.socket = None
+        if self.running:
+            self.reconnectTimer.start(self.reconnectDelay)
+
+    # only used internally
+    def keepalive(self):
+        if (time.monotonic() - self.lastMessage) > self.keepaliveTimeout:
+            print("Push connection to OctoPrint " + self.api.host + " timed out")
+            self.socket.abort()
+        else:
+            self.socket.ping()
+
+    # only used internally
+    def pongReceived(self, elapsed, payload):
+        self.lastMessage = time.monotonic()
+
+    # only used internally
+    def messageReceived(self, text):
+        self.lastMessage = time.monotonic()
+
+        try:
+            msg = json.loads(text)
+        except json.JSONDecodeError:
+            return
+
+        if "connected" in msg:
+            self.socket.sendTextMessage(json.dumps({ "auth": self.session }))
+            self.authenticated = True
+
+        for key in [ "history", "current" ]:
+            if key in msg:
+                self.update(msg[key])
+
+    # only used internally
+    def update(self, data):
+        state = {}
+        if "state" in data:
+            state = data["state"]
+
+        job = {}
+        if "job" in data:
+            job["job"] = data["job"]
+        if "progress" in data:
+            job["progress"] = data["progress"]
+        if "text" in state:
+            job["state"] = state["text"]
+        self.jobState = job
+
+        printer = { "state": state, "temperature": {} }
+        if self.printerState != None:
+            printer["temperature"] = self.printerState["temperature"]
+
+        # history contains many samples, current only the newest ones
+        if ("temps" in data) and (len(data["temps"]) > 0):
+            printer["temperature"] = { k: v for k, v in data["temps"][-1].items() if k != "time" }
+        self.printerState = printer
@@ -256,7 +256,7 @@ class SettingsWindow(QWidget):
         return (True, "")
 
     def printerDiffers(self, a, b):
-        if (a.host != b.host) or (a.key != b.key) or (a.tempTool != b.tempTool) or (a.tempBed != b.tempBed) or (a.jogSpeed != b.jogSpeed) or (a.jogLength != b.jogLength) or (a.webcam != b.webcam):
+        if (a.host != b.host) or (a.apiType != b.apiType) or (a.key != b.key) or (a.tempTool != b.tempTool) or (a.tempBed != b.tempBed) or (a.jogSpeed != b.jogSpeed) or (a.jogLength != b.jogLength) or (a.webcam != b.webcam):
             return True
         return False
 
@@ -285,11 +285,11 @@ class SettingsWindow(QWidget):
                 return
 
         if self.printersDiffer(oldPrinters, newPrinters):
-            r = self.parent.showDialog(self.parent.name + " Settings Changed", "Do you want to save the new configuration?", "This will restart the application!", True, False, False)
+            r = self.parent.showDialog(self.parent.name + " Settings Changed", "Do you want to save the new configuration?", "Changed printers will be reloaded.", True, False, False)
             if r == True:
                 self.parent.writeSettings(newPrinters)
                 self.parent.removeSettingsWindow()
-                self.parent.restartApp()
+                self.parent.reloadSettings()
 
         self.parent.removeSettingsWindow()
 
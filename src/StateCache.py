@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+# OctoTray Linux Qt System Tray OctoPrint client
+#
+# StateCache.py
+#
+# Short-lived cache for printer state, keyed by API endpoint.
+# Concurrent callers of the same endpoint share one fetch.
+
+import threading
+import time
+
+class StateCache():
+    def __init__(self, timeout):
+        self.timeout = timeout # in s
+        self.entries = {} # key -> tuple ( time of fetch, value )
+        self.pending = {} # key -> threading.Event of running fetch
+        self.generation = 0 # counts invalidations
+        self.lock = threading.Lock()
+
+    # return cached value for key, or call fetch() to get it.
+    # when another thread is already fetching the same key,
+    # wait for its result instead of fetching again.
+    def get(self, key, fetch):
+        while True:
+            with self.lock:
+                if key in self.entries:
+                    t, value = self.entries[key]
+                    if (time.monotonic() - t) < self.timeout:
+                        return value
+
+                event = self.pending.get(key)
+                if event == None:
+                    event = threading.Event()
+                    self.pending[key] = event
+                    generation = self.generation
+                    break
+
+            event.wait()
+
+        try:
+            value = fetch()
+            with self.lock:
+                # don't store results started before an invalidation
+                if generation == self.generation:
+                    self.entries[key] = (time.monotonic(), value)
+            return value
+        finally:
+            with self.lock:
+                del self.pending[key]
+            event.set()
+
+    # forget all cached values, eg. after changing printer state
+    def invalidate(self):
+        with self.lock:
+            self.entries = {}
+            self.generation += 1
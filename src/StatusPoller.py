@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+# OctoTray Linux Qt System Tray OctoPrint client
+#
+# StatusPoller.py
+#
+# Central source of printer status for all overview windows.
+# Printers are polled one after another, spread evenly over the
+# polling period, so the farm never sees bursts of requests.
+
+import time
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+class StatusPoller(QObject):
+    # emitted in GUI thread with printer that got new status
+    statusUpdated = pyqtSignal(object)
+
+    def __init__(self, parent, *args, **kwargs):
+        super(StatusPoller, self).__init__(*args, **kwargs)
+        self.parent = parent
+        self.period = parent.statusPollPeriodIdle
+        self.index = 0
+        self.status = {} # printer: dict from api.getStatus()
+        self.pending = {} # printer: time of request
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.pollNext)
+
+    def start(self):
+        if not self.timer.isActive():
+            self.updateInterval()
+            self.timer.start()
+
+            # don't wait a full interval for the first result
+            self.pollNext()
+
+    def stop(self):
+        self.timer.stop()
+
+    # in s, for all printers together
+    def setPeriod(self, period):
+        self.period = period
+        self.updateInterval()
+
+    # latest status of printer or None
+    def getStatus(self, printer):
+        return self.status.get(printer, None)
+
+    # only used internally
+    def printers(self):
+        return [ p for p in self.parent.printers if p.api != None ]
+
+    # only used internally, one printer per tick
+    def updateInterval(self):
+        n = max(1, len(self.printers()))
+        self.timer.setInterval(int(self.period * 1000 / n))
+
+    # only used internally
+    def pollNext(self):
+        printers = self.printers()
+
+        # printers may have changed with the settings
+        self.updateInterval()
+        for p in [ p for p in self.status if p not in printers ]:
+            del self.status[p]
+
+        if len(printers) == 0:
+            return
+
+        self.index = self.index % len(printers)
+        p = printers[self.index]
+        self.index += 1
+
+        # slow printers are not asked again before answering,
+        # unless the request seems to have been lost
+        if (p in self.pending) and ((time.monotonic() - self.pending[p]) < self.period):
+            return
+
+        self.pending[p] = time.monotonic()
+        self.parent.tasks.run(self.fetchStatus, self.statusReceived, p)
+
+    # runs in worker thread
+    def fetchStatus(self, printer):
+        return (printer, printer.api.getStatus())
+
+    # runs in GUI thread
+    def statusReceived(self, result):
+        printer, status = result
+        self.pending.pop(printer, None)
+
+        if printer not in self.printers():
+            return
+
+        self.status[printer] = status
+        self.statusUpdated.emit(printer)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+# OctoTray Linux Qt System Tray OctoPrint client
+#
+# StatusWatcher.py
+#
+# Watches the results of the StatusPoller for interesting
+# changes and shows notifications for them. Each condition
+# is only reported once, until it has cleared again.
+
+import time
+from PyQt5.QtCore import QObject
+
+class StatusWatcher(QObject):
+    thermalOvershoot = 15.0 # in deg C above target
+    thermalOffLimit = 50.0 # in deg C, heater off and still getting hotter
+    thermalRiseLimit = 0.1 # in deg C per s, while heater is off
+    thermalRiseCount = 2 # consecutive rising samples needed
+
+    # a job may pass some of these before it has ended, like
+    # Printing, Finishing, Operational or Paused, Cancelling, Operational
+    jobStates = [
+        "printing", "pausing", "paused", "resuming", "finishing", "cancelling"
+    ]
+
+    def __init__(self, parent, *args, **kwargs):
+        super(StatusWatcher, self).__init__(*args, **kwargs)
+        self.parent = parent
+        self.poller = parent.poller
+
+        # printer: dict with "state", "jobActive", "temperatures" and "time" of last sample
+        self.last = {}
+
+        # printer: dict of heater name: number of rising samples
+        self.rising = {}
+
+        # printer: list of currently reported conditions
+        self.reported = {}
+
+        self.poller.statusUpdated.connect(self.statusUpdated)
+
+    # only used internally
+    def statusUpdated(self, printer):
+        status = self.poller.getStatus(printer)
+        if status == None:
+            return
+
+        # forget printers removed from the settings
+        for p in [ p for p in self.last if p not in self.parent.printers ]:
+            del self.last[p]
+            self.rising.pop(p, None)
+            self.reported.pop(p, None)
+
+        now = time.monotonic()
+        last = self.last.get(printer, None)
+
+        # unreachable printers tell nothing about transitions
+        if status["state"] == "Unknown":
+            return
+
+        self.last[printer] = {
+            "state": status["state"],
+            "jobActive": self.isJobActive(status["state"]),
+            "temperatures": status["temperatures"],
+            "time": now
+        }
+
+        # nothing to compare with for first sample
+        if last == None:
+            return
+
+        self.checkState(printer, status, last)
+        self.checkTemperatures(printer, status, last, now)
+
+    # only used internally
+    def isJobActive(self, state):
+        return any(state.lower().startswith(s) for s in self.jobStates)
+
+    # only used internally
+    def checkState(self, printer, status, last):
+        state = status["state"]
+        if state == last["state"]:
+            return
+
+        # errors get their own notification below
+        if last["jobActive"] and (not self.isJobActive(state)) and ("error" not in state.lower()):
+            self.parent.showNotification("Print Job Ended", status["name"] + " has stopped printing.", False)
+
+        if "error" in state.lower():
+            self.notify(printer, "error", "Printer Error", status["name"] + " reports: " + state)
+        else:
+            self.clear(printer, "error")
+
+    # only used internally
+    def checkTemperatures(self, printer, status, last, now):
+        rising = self.rising.setdefault(printer, {})
+        dt = now - last["time"]
+
+        for name, temps in status["temperatures"].items():
+            actual, target = temps
+            condition = "thermal " + name
+
+            lastActual = None
+            lastTarget = None
+            if name in last["temperatures"]:
+                lastActual, lastTarget = last["temperatures"][name]
+
+            if (target != None) and (target > 0.0):
+                rising[name] = 0
+                if actual > (target + self.thermalOvershoot):
+                    # after lowering the target, heater needs time to cool down.
+                    # only a steady target with rising temperature is suspicious.
+                    if (lastActual != None) and (lastTarget == target) and (actual > lastActual):
+                        self.notify(printer, condition, "Temperature Warning", status["name"] + " " + name + " is at %.1f, above its target of %.1f!" % (actual, target))
+                else:
+                    self.clear(printer, condition)
+                continue
+
+            # heater is off, but temperature keeps rising
+            if (lastActual != None) and (dt > 0.0) and (actual > self.thermalOffLimit) and (((actual - lastActual) / dt) > self.thermalRiseLimit):
+                rising[name] = rising.get(name, 0) + 1
+            else:
+                rising[name] = 0
+
+            if rising[name] >= self.thermalRiseCount:
+                self.notify(printer, condition, "Temperature Warning", status["name"] + " " + name + " is heating up to %.1f while turned off!" % actual)
+            elif actual <= self.thermalOffLimit:
+                self.clear(printer, condition)
+
+    # only used internally, shows notification once per condition
+    def notify(self, printer, condition, title, text):
+        reported = self.reported.setdefault(printer, [])
+        if condition in reported:
+            return
+
+        reported.append(condition)
+        self.parent.showNotification(title, text, True)
+
+    # only used internally, condition may be reported again
+    def clear(self, printer, condition):
+        reported = self.reported.get(printer, [])
+        if condition in reported:
+            reported.remove(condition)
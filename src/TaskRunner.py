@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+# OctoTray Linux Qt System Tray OctoPrint client
+#
+# TaskRunner.py
+#
+# Runs blocking functions in a pool of worker threads
+# and hands their results back to the GUI thread.
+
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import QObject, pyqtSignal
+
+class TaskRunner(QObject):
+    # emitted from worker threads, delivered
+    # queued in the thread of this object
+    finished = pyqtSignal(object, object)
+
+    def __init__(self, threads, *args, **kwargs):
+        super(TaskRunner, self).__init__(*args, **kwargs)
+        self.active = True
+        self.executor = ThreadPoolExecutor(max_workers = threads)
+
+        # not yet finished, so queued ones can be cancelled
+        self.futures = set()
+        self.futuresLock = threading.Lock()
+        self.finished.connect(self.handleFinished)
+
+    # call func(*args) in a worker thread,
+    # then callback(result) in the GUI thread.
+    # when func raises, error(exception) is called
+    # in the GUI thread instead. both may be None.
+    def run(self, func, callback, *args, error = None):
+        if not self.active:
+            return
+
+        def task():
+            try:
+                result = func(*args)
+            except Exception as e:
+                print("Error in background task:")
+                traceback.print_exc()
+                if self.active and (error != None):
+                    self.finished.emit(error, e)
+                return
+
+            if self.active and (callback != None):
+                self.finished.emit(callback, result)
+
+        future = self.executor.submit(task)
+        with self.futuresLock:
+            self.futures.add(future)
+        future.add_done_callback(self.taskDone)
+
+    # only used internally, called in worker thread or on cancel
+    def taskDone(self, future):
+        with self.futuresLock:
+            self.futures.discard(future)
+
+    def handleFinished(self, callback, result):
+        if self.active:
+            callback(result)
+
+    # results of tasks still running are discarded, queued tasks
+    # are cancelled, so exit does not wait for obsolete requests.
+    # cancel_futures of shutdown() would need Python 3.9.
+    def stop(self):
+        self.active = False
+        with self.futuresLock:
+            futures = list(self.futures)
+        for future in futures:
+            future.cancel()
+        self.executor.shutdown(wait = False)
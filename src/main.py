@@ -23,10 +23,4 @@ if ("windowed" in sys.argv) or ("--windowed" in sys.argv) or ("-w" in sys.argv):
 
 tray = OctoTray(app, inSysTray)
 rc = app.exec_()
-
-while rc == 42:
-    tray.closeAll()
-    tray = OctoTray(app, inSysTray)
-    rc = app.exec_()
-
 sys.exit(rc)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+# OctoTray Linux Qt System Tray OctoPrint client
+#
+# test_HostProbe.py
+#
+# Run with 'python -m unittest discover tests' from the repo root.
+
+import os
+import socket
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+from HostProbe import HostProbe
+
+class TestHostProbe(unittest.TestCase):
+    def testHostnameOnly(self):
+        p = HostProbe("octopi.local")
+        self.assertEqual((p.host, p.port), ("octopi.local", 80))
+
+    def testPort(self):
+        p = HostProbe("127.0.0.1:5000")
+        self.assertEqual((p.host, p.port), ("127.0.0.1", 5000))
+
+    def testPath(self):
+        p = HostProbe("octopi.local/octoprint")
+        self.assertEqual((p.host, p.port), ("octopi.local", 80))
+
+        p = HostProbe("127.0.0.1:5000/op")
+        self.assertEqual((p.host, p.port), ("127.0.0.1", 5000))
+
+    def testIPv6(self):
+        p = HostProbe("[::1]:8080")
+        self.assertEqual((p.host, p.port), ("::1", 8080))
+
+    def testProbeWithPath(self):
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen(1)
+        try:
+            port = server.getsockname()[1]
+            p = HostProbe("127.0.0.1:" + str(port) + "/octoprint")
+            self.assertTrue(p.probe())
+            self.assertTrue(p.isReachable())
+        finally:
+            server.close()
+
+if __name__ == "__main__":
+    unittest.main()